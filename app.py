@@ -1,35 +1,154 @@
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
 from flask import Flask, request, jsonify, send_from_directory, redirect, render_template, Response, g
 from flask_cors import CORS
 import string
 import random
-import qrcode
-import io
-import base64
-from weasyprint import HTML
+import re
 import csv
+import io
+import itertools
+import importlib
+import math
 from functools import wraps
-from datetime import datetime
+from datetime import datetime, timezone
+from collections import deque
+from urllib.parse import urlparse, quote
 import os
 import json
+import time
+import hashlib
+import threading
+import click
+import atexit
+from cachetools import TLRUCache, TTLCache
+import ticket_pdf
+import qr_render
+import exports
+import metrics
 
 # --- Configuração do Firebase Admin (Adaptado para Produção) ---
-try:
-    # Para desenvolvimento local, lê o ficheiro
-    cred = credentials.Certificate("serviceAccountKey.json")
-except FileNotFoundError:
-    # Para produção (Render, Heroku, etc.), lê a variável de ambiente
-    service_account_info = json.loads(os.environ.get('SERVICE_ACCOUNT_JSON'))
-    cred = credentials.Certificate(service_account_info)
+# O firebase_admin, o cliente gRPC do Firestore e o WeasyPrint são pesados de importar.
+# Nada disso é carregado ao importar a app: o Firebase é inicializado no primeiro uso,
+# já dentro do worker do Gunicorn (depois do fork), o que também é o exigido pelo gRPC.
+_firebase_lock = threading.Lock()
+_firestore_client = None
+
+def init_firebase():
+    import firebase_admin
+    from firebase_admin import credentials
+    with _firebase_lock:
+        if firebase_admin._apps:
+            return
+        if os.environ.get('FIRESTORE_EMULATOR_HOST'):
+            class EmulatorCredential(credentials.Base):
+                # Credencial anónima para o Firestore Emulator (benchmarks e testes de concorrência)
+                def get_credential(self):
+                    from google.auth.credentials import AnonymousCredentials
+                    return AnonymousCredentials()
+
+            firebase_admin.initialize_app(EmulatorCredential(), {'projectId': os.environ.get('GOOGLE_CLOUD_PROJECT', 'demo-scansys')})
+            return
+        try:
+            # Para desenvolvimento local, lê o ficheiro
+            cred = credentials.Certificate("serviceAccountKey.json")
+        except FileNotFoundError:
+            # Para produção (Render, Heroku, etc.), lê a variável de ambiente
+            service_account_info = json.loads(os.environ.get('SERVICE_ACCOUNT_JSON'))
+            cred = credentials.Certificate(service_account_info)
+
+        firebase_admin.initialize_app(cred)
+
+def get_db():
+    global _firestore_client
+    if _firestore_client is None:
+        init_firebase()
+        from firebase_admin import firestore as firestore_module
+        metrics.instrument_firestore()
+        with _firebase_lock:
+            if _firestore_client is None:
+                _firestore_client = firestore_module.client()
+    return _firestore_client
 
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+def _load_auth():
+    init_firebase()
+    return importlib.import_module('firebase_admin.auth')
+
+class LazyModule:
+    # Resolve o objeto real no primeiro acesso a um atributo (db.collection, firestore.Increment, ...)
+    def __init__(self, loader):
+        self._loader = loader
+        self._target = None
+
+    def __getattr__(self, name):
+        if self._target is None:
+            self._target = self._loader()
+        return getattr(self._target, name)
+
+db = LazyModule(get_db)
+firestore = LazyModule(lambda: importlib.import_module('firebase_admin.firestore'))
+auth = LazyModule(lambda: metrics.TimedModule(_load_auth(), 'auth'))
+# Usado apenas em cláusulas 'except', avaliadas só quando a exceção acontece
+api_exceptions = LazyModule(lambda: importlib.import_module('google.api_core.exceptions'))
+
+def warm_up(pdf=False):
+    # Paga antecipadamente o custo do primeiro pedido: Firebase, canal gRPC do Firestore e qrcode.
+    # Chamado pelo Gunicorn em cada worker (ver gunicorn.conf.py) ou manualmente.
+    started = time.perf_counter()
+    get_db().collection('events').limit(1).get()
+    _load_auth()
+    qr_render.render_qr('warm-up', 4, 'svg')
+    if pdf:
+        ticket_pdf.warm_up_render_pool()
+    return time.perf_counter() - started
+
+# --- Configuração de desempenho ---
+# Número máximo de tokens já verificados mantidos em memória por worker.
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 1024))
+# Renderiza o PDF em segundo plano logo após a emissão do convite.
+PDF_PRERENDER = os.environ.get('PDF_PRERENDER', '0') == '1'
+# Cache dos QR Codes de marketing usados no redirecionamento /r/<short_id>.
+QR_CACHE_SIZE = int(os.environ.get('QR_CACHE_SIZE', 512))
+QR_CACHE_TTL = int(os.environ.get('QR_CACHE_TTL', 60))
+# Validade (segundos) do diretório de utilizadores em cache e espelho opcional na coleção 'users'.
+USERS_CACHE_TTL = int(os.environ.get('USERS_CACHE_TTL', 30))
+USERS_MIRROR = os.environ.get('USERS_MIRROR', '0') == '1'
+# Intervalo (segundos) entre gravações acumuladas de scanCount.
+SCAN_FLUSH_INTERVAL = float(os.environ.get('SCAN_FLUSH_INTERVAL', 10))
+# Máximo de leituras à espera de agregação; acima disto as mais antigas são descartadas.
+SCAN_ANALYTICS_QUEUE_SIZE = int(os.environ.get('SCAN_ANALYTICS_QUEUE_SIZE', 50000))
+# Máximo de origens (referrers) distintas por balde de estatísticas, por worker; as restantes contam como 'outro'.
+SCAN_REFERRERS_PER_BUCKET = int(os.environ.get('SCAN_REFERRERS_PER_BUCKET', 20))
+# Pedidos mais lentos que isto (ms) são registados com o detalhe das chamadas; 0 desliga.
+SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 0))
+# Máximo de linhas aceites numa importação de lista de convidados.
+IMPORT_MAX_ROWS = int(os.environ.get('IMPORT_MAX_ROWS', 10000))
+# Se definido, /metrics exige 'Authorization: Bearer <METRICS_TOKEN>'.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
 
 # --- Inicialização do Flask ---
 app = Flask(__name__, static_folder='static', static_url_path='', template_folder='templates')
 CORS(app)
 
+# --- Métricas por pedido ---
+# Cada pedido conta as chamadas ao Firestore/Auth que faz (ver metrics.py). A contagem fecha
+# quando o servidor termina de enviar a resposta, para incluir as exportações em streaming.
+@app.before_request
+def start_request_metrics():
+    g.request_metrics = metrics.begin_request(request.url_rule.rule if request.url_rule else 'unmatched')
+
+@app.after_request
+def finish_request_metrics(response):
+    stats = g.get('request_metrics')
+    if stats is not None:
+        method, path, status = request.method, request.path, response.status_code
+        response.call_on_close(lambda: log_request_metrics(stats, method, path, status))
+    return response
+
+def log_request_metrics(stats, method, path, status):
+    elapsed = metrics.finish_request(stats, method, status)
+    if elapsed is not None and SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        app.logger.warning("Pedido lento: %s %s -> %s em %.0f ms (%s) | %s",
+                           method, path, status, elapsed * 1000, stats.route, stats.breakdown())
+
 # ===================================================================
 # FUNÇÕES AUXILIARES E DECORADOR DE AUTENTICAÇÃO
 # ===================================================================
@@ -37,6 +156,37 @@ def generate_short_id(length=7):
     characters = string.ascii_letters + string.digits
     return ''.join(random.choice(characters) for i in range(length))
 
+# --- Cache local de tokens verificados ---
+# Os scanners enviam centenas de pedidos por minuto com o mesmo ID token.
+# Guardamos o token descodificado (chave: hash SHA-256 do token) até ao seu 'exp',
+# com despejo LRU quando o cache enche.
+_token_cache = TLRUCache(maxsize=TOKEN_CACHE_SIZE, ttu=lambda _key, claims, _now: claims.get('exp', 0), timer=time.time)
+_token_cache_lock = threading.Lock()
+_token_cache_stats = {'hits': 0, 'misses': 0}
+
+def verify_token_cached(token):
+    key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    with _token_cache_lock:
+        claims = _token_cache.get(key)
+        if claims is not None:
+            _token_cache_stats['hits'] += 1
+            return claims
+        _token_cache_stats['misses'] += 1
+    claims = auth.verify_id_token(token)
+    with _token_cache_lock:
+        _token_cache[key] = claims
+    return claims
+
+def token_cache_metrics():
+    with _token_cache_lock:
+        hits, misses = _token_cache_stats['hits'], _token_cache_stats['misses']
+        size = len(_token_cache)
+    total = hits + misses
+    return {
+        'size': size, 'maxSize': TOKEN_CACHE_SIZE, 'hits': hits, 'misses': misses,
+        'hitRate': round(hits / total, 4) if total else 0.0
+    }
+
 def check_token(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -45,16 +195,106 @@ def check_token(f):
             return jsonify({"error": "Token de autorização em falta."}), 401
         try:
             token = token.split("Bearer ")[1]
-            decoded_token = auth.verify_id_token(token)
+            decoded_token = verify_token_cached(token)
             g.user = decoded_token # Usa g para guardar o utilizador
         except Exception as e:
             return jsonify({"error": "Token inválido ou expirado."}), 401
         return f(*args, **kwargs)
     return decorated
 
+# --- Paginação das listagens ---
+# ?limit= ativa a paginação; o cursor para a página seguinte vem no cabeçalho X-Next-Cursor
+# (ID do último documento) e volta no pedido seguinte como ?startAfter=. ?fields= projeta as colunas.
+MAX_PAGE_SIZE = 1000
+
+class InvalidCursor(Exception):
+    pass
+
+def paginated_response(collection_name, query):
+    limit = request.args.get('limit', type=int)
+    start_after = request.args.get('startAfter')
+    fields = request.args.get('fields')
+    if fields:
+        query = query.select([field.strip() for field in fields.split(',') if field.strip()])
+    if start_after:
+        cursor_doc = db.collection(collection_name).document(start_after).get()
+        if not cursor_doc.exists:
+            raise InvalidCursor(start_after)
+        query = query.start_after(cursor_doc)
+    if limit:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        query = query.limit(limit)
+    docs = list(query.stream())
+    response = jsonify([doc.to_dict() for doc in docs])
+    if limit and len(docs) == limit:
+        response.headers['X-Next-Cursor'] = docs[-1].id
+    return response, 200
+
+def invalid_cursor_response():
+    return jsonify({"error": "Cursor 'startAfter' inválido."}), 400
+
+EXPORT_PAGE_SIZE = 500
+
+def iter_query_pages(query, page_size=EXPORT_PAGE_SIZE):
+    # Percorre a consulta em páginas com cursor, sem carregar a coleção inteira
+    last_doc = None
+    while True:
+        page_query = query.limit(page_size)
+        if last_doc is not None:
+            page_query = page_query.start_after(last_doc)
+        docs = list(page_query.stream())
+        yield from docs
+        if len(docs) < page_size:
+            return
+        last_doc = docs[-1]
+
+def prefetch_query_pages(query, page_size=EXPORT_PAGE_SIZE):
+    # Lê já a primeira página: erros da consulta (índice composto em falta...) dão 500
+    # em vez de um ficheiro "bem-sucedido" só com o cabeçalho
+    docs = iter_query_pages(query, page_size)
+    first = list(itertools.islice(docs, 1))
+    return itertools.chain(first, docs)
+
 # ===================================================================
 # ROTAS DA API - GESTÃO DE UTILIZADORES
 # ===================================================================
+# Diretório de utilizadores em cache: evita percorrer o Firebase Auth inteiro a cada
+# abertura da página. Com USERS_MIRROR=1 a lista vem de uma única consulta à coleção 'users'.
+_user_directory_cache = TTLCache(maxsize=1, ttl=USERS_CACHE_TTL)
+_user_directory_lock = threading.Lock()
+
+def user_directory_entry(user, role=None):
+    if role is None:
+        role = user.custom_claims.get('role', 'vendedor') if user.custom_claims else 'vendedor'
+    return {'uid': user.uid, 'email': user.email, 'displayName': user.display_name, 'role': role}
+
+def mirror_user(entry):
+    if USERS_MIRROR:
+        db.collection('users').document(entry['uid']).set(dict(entry, updatedAt=firestore.SERVER_TIMESTAMP))
+
+def set_user_role(user, role):
+    # Único ponto de alteração de perfis: mantém as claims, o espelho e o cache coerentes
+    auth.set_custom_user_claims(user.uid, {'role': role})
+    mirror_user(user_directory_entry(user, role))
+    invalidate_user_directory()
+
+def invalidate_user_directory():
+    # Com o lock: uma leitura em curso não volta a guardar no cache a lista anterior à alteração
+    with _user_directory_lock:
+        _user_directory_cache.clear()
+
+def load_user_directory():
+    with _user_directory_lock:
+        users = _user_directory_cache.get('users')
+        if users is None:
+            if USERS_MIRROR:
+                users = [doc.to_dict() for doc in db.collection('users').select(['uid', 'email', 'displayName', 'role']).stream()]
+            else:
+                users = [user_directory_entry(user) for user in auth.list_users().iterate_all()]
+            users.sort(key=lambda user: ((user.get('email') or '').lower(), user['uid']))
+            _user_directory_cache['users'] = users
+        return users
+
 @app.route('/api/users/create', methods=['POST'])
 @check_token
 def create_user():
@@ -67,7 +307,7 @@ def create_user():
         display_name = data['displayName']
         role = data.get('role', 'vendedor')
         user = auth.create_user(email=email, password=password, display_name=display_name)
-        auth.set_custom_user_claims(user.uid, {'role': role})
+        set_user_role(user, role)
         return jsonify({"success": True, "message": f"Utilizador {email} criado com sucesso."}), 201
     except Exception as e:
         return jsonify({"error": f"Erro ao criar utilizador: {e}"}), 500
@@ -78,13 +318,27 @@ def get_users():
     if g.user.get('role') != 'admin':
         return jsonify({"error": "Acesso não autorizado."}), 403
     try:
-        users_list = []
-        for user in auth.list_users().iterate_all():
-            users_list.append({
-                'uid': user.uid, 'email': user.email, 'displayName': user.display_name,
-                'role': user.custom_claims.get('role', 'vendedor') if user.custom_claims else 'vendedor'
-            })
-        return jsonify(users_list), 200
+        users_list = load_user_directory()
+        search = request.args.get('search', '').strip().lower()
+        if search:
+            users_list = [user for user in users_list
+                          if search in (user.get('email') or '').lower() or search in (user.get('displayName') or '').lower()]
+        # Mesma paginação das listagens do Firestore: 'limit', 'startAfter' (uid) e cabeçalho X-Next-Cursor
+        start_after = request.args.get('startAfter')
+        if start_after:
+            index = next((i for i, user in enumerate(users_list) if user['uid'] == start_after), None)
+            if index is None:
+                return invalid_cursor_response()
+            users_list = users_list[index + 1:]
+        limit = request.args.get('limit', type=int)
+        if limit:
+            limit = max(1, min(limit, MAX_PAGE_SIZE))
+            has_more = len(users_list) > limit
+            users_list = users_list[:limit]
+        response = jsonify(users_list)
+        if limit and has_more:
+            response.headers['X-Next-Cursor'] = users_list[-1]['uid']
+        return response, 200
     except Exception as e:
         return jsonify({"error": f"Erro ao buscar utilizadores: {e}"}), 500
 
@@ -125,9 +379,10 @@ def create_event():
 @check_token
 def get_events():
     try:
-        events_ref = db.collection('events').order_by('createdAt', direction=firestore.Query.DESCENDING).stream()
-        events_list = [event.to_dict() for event in events_ref]
-        return jsonify(events_list), 200
+        query = db.collection('events').order_by('createdAt', direction=firestore.Query.DESCENDING)
+        return paginated_response('events', query)
+    except InvalidCursor:
+        return invalid_cursor_response()
     except Exception as e:
         return jsonify({"error": f"Erro ao buscar eventos: {e}"}), 500
 
@@ -170,41 +425,346 @@ def update_event(event_id):
     except Exception as e:
         return jsonify({"error": f"Erro ao atualizar evento: {e}"}), 500
 
+TICKET_REQUIRED_FIELDS = ['eventId', 'eventName', 'buyerName', 'ticketType', 'pricePaid', 'paymentMethod']
+FIRESTORE_BATCH_LIMIT = 500
+# Convites por lote: deixa espaço para as escritas de eventStats no mesmo lote.
+TICKETS_PER_BATCH = 450
+
+def build_ticket_data(ticket_id, data, sold_by):
+    return {
+        'ticketId': ticket_id,
+        'eventId': data['eventId'],
+        'eventName': data['eventName'],
+        'buyerName': data['buyerName'],
+        'buyerPhone': data.get('buyerPhone'),
+        'ticketType': data['ticketType'],
+        'pricePaid': data['pricePaid'],
+        'paymentMethod': data['paymentMethod'],
+        'soldBy': sold_by,
+        'purchaseDate': firestore.SERVER_TIMESTAMP,
+        'updatedAt': firestore.SERVER_TIMESTAMP,
+        'status': 'VALIDO',
+        'checkInTimestamp': None,
+        'scannedBy': None,
+        'isDeleted': False,
+        'controlNumber': data.get('controlNumber', '')
+    }
+
+def write_tickets_batch(chunk):
+    # Grava até TICKETS_PER_BATCH convites ((chave, doc_ref, ticket_data)) e o eventStats num único lote
+    batch = db.batch()
+    stats_totals = {}
+    for _, doc_ref, ticket_data in chunk:
+        batch.set(doc_ref, ticket_data)
+        accumulate_event_stats(stats_totals, ticket_data, sold=1)
+    add_event_stats_writes(batch, stats_totals)
+    batch.commit()
+
+def ticket_pdf_url(ticket_id):
+    return request.host_url + f"api/event/ticket/{ticket_id}/pdf"
+
+def prerender_ticket_pdfs(tickets_data):
+    # Lê os eventos fora do pedido e envia as renderizações para o pool de processos
+    def run():
+        try:
+            events_cache = {}
+            for ticket_data in tickets_data:
+                event_id = ticket_data['eventId']
+                if event_id not in events_cache:
+                    event_doc = db.collection('events').document(event_id).get()
+                    events_cache[event_id] = event_doc.to_dict() if event_doc.exists else {}
+                ticket_pdf.submit_prerender(ticket_data, events_cache[event_id])
+        except Exception as e:
+            app.logger.error(f"Erro ao pré-renderizar PDFs: {e}")
+    threading.Thread(target=run, daemon=True).start()
+
+# --- Estatísticas agregadas por evento (eventStats/<eventId>) ---
+# Mantidas com firestore.Increment na mesma escrita em lote que altera o convite, para
+# que os painéis leiam um punhado de documentos em vez de descarregar todos os convites.
+# Contam apenas convites não excluídos; 'deleted' conta os excluídos.
+# Os incrementos vão para eventStats/<eventId>/shards/<n>, escolhido ao acaso: na abertura
+# das portas todas as validações de um evento escreviam no mesmo documento, acima do
+# limite de ~1 escrita/s por documento. O documento base guarda o último recálculo e a
+# leitura soma-o com os shards.
+EVENT_STATS_SHARDS = int(os.environ.get('EVENT_STATS_SHARDS', 10))
+def ticket_price(ticket_data):
+    try:
+        return float(ticket_data.get('pricePaid') or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def _empty_event_stats(event_id):
+    return {'eventId': event_id, 'sold': 0, 'checkedIn': 0, 'deleted': 0, 'revenue': 0.0, 'byTicketType': {}, 'bySeller': {}}
+
+def accumulate_event_stats(totals, ticket_data, sold=0, checked_in=0, deleted=0):
+    revenue = ticket_price(ticket_data) * sold
+    stats = totals.setdefault(ticket_data['eventId'], _empty_event_stats(ticket_data['eventId']))
+    stats['sold'] += sold
+    stats['checkedIn'] += checked_in
+    stats['deleted'] += deleted
+    stats['revenue'] += revenue
+    by_type = stats['byTicketType'].setdefault(ticket_data.get('ticketType') or 'Sem tipo', {'sold': 0, 'checkedIn': 0, 'revenue': 0.0})
+    by_type['sold'] += sold
+    by_type['checkedIn'] += checked_in
+    by_type['revenue'] += revenue
+    by_seller = stats['bySeller'].setdefault(ticket_data.get('soldBy') or 'Desconhecido', {'sold': 0, 'revenue': 0.0})
+    by_seller['sold'] += sold
+    by_seller['revenue'] += revenue
+    return totals
+
+def _as_increments(value):
+    if isinstance(value, dict):
+        return {k: _as_increments(v) for k, v in value.items()}
+    return firestore.Increment(value)
+
+def event_stats_shards(event_id):
+    return db.collection('eventStats').document(event_id).collection('shards')
+
+def add_event_stats_writes(batch, totals):
+    # Uma escrita por evento; set(merge=True) aceita nomes de tipo/vendedor com qualquer carácter
+    for event_id, stats in totals.items():
+        update_data = _as_increments({k: v for k, v in stats.items() if k != 'eventId'})
+        update_data['eventId'] = event_id
+        update_data['updatedAt'] = firestore.SERVER_TIMESTAMP
+        shard_id = str(random.randrange(EVENT_STATS_SHARDS))
+        batch.set(event_stats_shards(event_id).document(shard_id), update_data, merge=True)
+
+def _add_event_stats(stats, shard):
+    for key, value in shard.items():
+        if key in ('eventId', 'updatedAt'):
+            continue
+        if isinstance(value, dict):
+            _add_event_stats(stats.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)):
+            stats[key] = stats.get(key, 0) + value
+    return stats
+
+def load_event_stats(event_id):
+    doc = db.collection('eventStats').document(event_id).get()
+    stats = doc.to_dict() if doc.exists else _empty_event_stats(event_id)
+    for shard in event_stats_shards(event_id).stream():
+        _add_event_stats(stats, shard.to_dict())
+    stats.pop('updatedAt', None)
+    return stats
+
+def rebuild_event_stats(event_id):
+    totals = {event_id: _empty_event_stats(event_id)}
+    query = db.collection('eventTickets').where('eventId', '==', event_id).order_by('purchaseDate')
+    query = query.select(['eventId', 'pricePaid', 'ticketType', 'soldBy', 'status', 'isDeleted'])
+    for t in iter_query_pages(query):
+        ticket_data = t.to_dict()
+        if ticket_data.get('isDeleted'):
+            accumulate_event_stats(totals, ticket_data, deleted=1)
+        else:
+            accumulate_event_stats(totals, ticket_data, sold=1, checked_in=1 if ticket_data.get('status') == 'CHECK_IN_REALIZADO' else 0)
+    stats = totals[event_id]
+    stats['updatedAt'] = firestore.SERVER_TIMESTAMP
+    # O recálculo substitui o documento base e zera os shards no mesmo lote
+    batch = db.batch()
+    batch.set(db.collection('eventStats').document(event_id), stats)
+    for shard_ref in event_stats_shards(event_id).list_documents():
+        batch.delete(shard_ref)
+    batch.commit()
+    return stats
+
 @app.route('/api/event/ticket/create', methods=['POST'])
 @check_token
 def create_ticket():
     try:
         data = request.get_json()
-        required_fields = ['eventId', 'eventName', 'buyerName', 'ticketType', 'pricePaid', 'paymentMethod']
-        if not all(field in data for field in required_fields):
+        if not all(field in data for field in TICKET_REQUIRED_FIELDS):
             return jsonify({"error": "Dados incompletos."}), 400
         
         doc_ref = db.collection('eventTickets').document()
         ticket_id = doc_ref.id
+        ticket_data = build_ticket_data(ticket_id, data, g.user.get('name', g.user.get('email')))
+        batch = db.batch()
+        batch.set(doc_ref, ticket_data)
+        add_event_stats_writes(batch, accumulate_event_stats({}, ticket_data, sold=1))
+        batch.commit()
+        if PDF_PRERENDER:
+            prerender_ticket_pdfs([ticket_data])
         
-        control_number = data.get('controlNumber', '')
+        return jsonify({ "success": True, "ticketId": ticket_id, "pdfUrl": ticket_pdf_url(ticket_id) }), 201
+    except Exception as e:
+        return jsonify({"error": f"Erro interno no servidor: {e}"}), 500
 
-        ticket_data = {
-            'ticketId': ticket_id,
-            'eventId': data['eventId'],
-            'eventName': data['eventName'],
-            'buyerName': data['buyerName'],
-            'buyerPhone': data.get('buyerPhone'),
-            'ticketType': data['ticketType'],
-            'pricePaid': data['pricePaid'],
-            'paymentMethod': data['paymentMethod'],
-            'soldBy': g.user.get('name', g.user.get('email')),
-            'purchaseDate': firestore.SERVER_TIMESTAMP,
-            'status': 'VALIDO',
-            'checkInTimestamp': None,
-            'scannedBy': None,
-            'isDeleted': False,
-            'controlNumber': control_number
-        }
-        doc_ref.set(ticket_data)
-        
-        pdf_url = request.host_url + f"api/event/ticket/{ticket_id}/pdf"
-        return jsonify({ "success": True, "ticketId": ticket_id, "pdfUrl": pdf_url }), 201
+@app.route('/api/event/ticket/create-batch', methods=['POST'])
+@check_token
+def create_tickets_batch():
+    # Emite vários convites num único pedido, usando escritas em lote do Firestore
+    try:
+        data = request.get_json()
+        tickets = data.get('tickets') if data else None
+        if not isinstance(tickets, list) or len(tickets) == 0:
+            return jsonify({"error": "Uma lista 'tickets' com pelo menos um convite é obrigatória."}), 400
+
+        sold_by = g.user.get('name', g.user.get('email'))
+        results = [None] * len(tickets)
+        pending = []  # (índice, doc_ref, ticket_data)
+        for index, spec in enumerate(tickets):
+            if not isinstance(spec, dict) or not all(field in spec for field in TICKET_REQUIRED_FIELDS):
+                results[index] = {"index": index, "success": False, "error": "Dados incompletos."}
+                continue
+            doc_ref = db.collection('eventTickets').document()
+            pending.append((index, doc_ref, build_ticket_data(doc_ref.id, spec, sold_by)))
+
+        # Um lote do Firestore aceita no máximo 500 operações.
+        for start in range(0, len(pending), TICKETS_PER_BATCH):
+            chunk = pending[start:start + TICKETS_PER_BATCH]
+            try:
+                write_tickets_batch(chunk)
+                for index, doc_ref, _ in chunk:
+                    results[index] = {"index": index, "success": True, "ticketId": doc_ref.id, "pdfUrl": ticket_pdf_url(doc_ref.id)}
+            except Exception as e:
+                for index, _, _ in chunk:
+                    results[index] = {"index": index, "success": False, "error": f"Erro ao gravar convite: {e}"}
+
+        if PDF_PRERENDER:
+            prerender_ticket_pdfs([ticket_data for index, _, ticket_data in pending if results[index]['success']])
+
+        created = sum(1 for r in results if r['success'])
+        status_code = 201 if created > 0 else 400
+        return jsonify({"success": created > 0, "created": created, "failed": len(results) - created, "results": results}), status_code
+    except Exception as e:
+        return jsonify({"error": f"Erro interno no servidor: {e}"}), 500
+
+# --- Importação de listas de convidados (CSV) ---
+# O ficheiro é lido linha a linha e os convites válidos são gravados em lotes de
+# TICKETS_PER_BATCH à medida que a leitura avança, sem montar a lista inteira em memória.
+# Aceita os nomes de coluna da API e os do relatório exportado (Comprador, Tipo Convite...).
+IMPORT_COLUMN_ALIASES = {
+    'buyername': 'buyerName', 'comprador': 'buyerName', 'nome': 'buyerName', 'name': 'buyerName',
+    'buyerphone': 'buyerPhone', 'telefone': 'buyerPhone', 'phone': 'buyerPhone',
+    'tickettype': 'ticketType', 'tipo convite': 'ticketType', 'tipo': 'ticketType',
+    'pricepaid': 'pricePaid', 'preco': 'pricePaid', 'preço': 'pricePaid', 'price': 'pricePaid',
+    'paymentmethod': 'paymentMethod', 'metodo pagamento': 'paymentMethod', 'método pagamento': 'paymentMethod',
+    'controlnumber': 'controlNumber', 'numero de controlo': 'controlNumber',
+}
+
+def iter_import_rows(stream):
+    # Devolve (número da linha, {coluna: valor}); o separador (',' ou ';', comum no Excel em PT/BR) vem do cabeçalho
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    header_line = text.readline()
+    delimiter = ';' if header_line.count(';') > header_line.count(',') else ','
+    reader = csv.reader(itertools.chain([header_line], text), delimiter=delimiter)
+    header = [IMPORT_COLUMN_ALIASES.get(column.strip().lower(), column.strip()) for column in next(reader, [])]
+    if 'buyerName' not in header or 'ticketType' not in header:
+        raise ValueError("O CSV precisa das colunas 'buyerName' (ou 'Comprador') e 'ticketType' (ou 'Tipo Convite').")
+    for row in reader:
+        if not any(value.strip() for value in row):
+            continue
+        yield reader.line_num, {column: value.strip() for column, value in zip(header, row)}
+
+def parse_import_price(value):
+    # Aceita 50, 50.00, 50,00 e os milhares em pt-BR (R$ 1.234,50) ou en (1,234.50);
+    # recusa negativos, nan e inf, que iriam parar ao pricePaid e à receita do eventStats
+    text = value.replace('R$', '').replace(' ', '').strip()
+    if ',' in text and '.' in text and text.rfind('.') > text.rfind(','):
+        text = text.replace(',', '')
+    elif ',' in text:
+        text = text.replace('.', '').replace(',', '.')
+    price = float(text)
+    if not math.isfinite(price) or price < 0:
+        raise ValueError(f"Preço fora do intervalo: {value}")
+    return round(price, 2)
+
+def import_row_to_ticket(row, event_data, ticket_types, default_payment_method):
+    # Valida uma linha contra os tipos de convite do evento; devolve os dados do convite ou levanta ValueError
+    if not row.get('buyerName'):
+        raise ValueError("Nome do convidado em falta.")
+    ticket_type = ticket_types.get(row.get('ticketType', '').lower())
+    if ticket_type is None:
+        raise ValueError(f"Tipo de convite inexistente: '{row.get('ticketType', '')}'.")
+    if not ticket_type.get('active', True):
+        raise ValueError(f"Tipo de convite inativo: '{ticket_type['name']}'.")
+    payment_method = row.get('paymentMethod') or default_payment_method
+    if row.get('pricePaid'):
+        try:
+            price = parse_import_price(row['pricePaid'])
+        except ValueError:
+            raise ValueError(f"Preço inválido: '{row['pricePaid']}'.")
+    else:
+        price = 0.0 if payment_method == 'Cortesia' else float(ticket_type.get('price', 0))
+    return {
+        'eventId': event_data['eventId'], 'eventName': event_data.get('eventName', ''), 'buyerName': row['buyerName'],
+        'buyerPhone': row.get('buyerPhone') or None, 'ticketType': ticket_type['name'], 'pricePaid': price,
+        'paymentMethod': payment_method, 'controlNumber': row.get('controlNumber', '')
+    }
+
+@app.route('/api/events/<event_id>/tickets/import', methods=['POST'])
+@check_token
+def import_event_tickets(event_id):
+    # Corpo: CSV em bruto (Content-Type: text/csv) ou multipart com o campo 'file'.
+    # Parâmetros: paymentMethod (omissão 'Cortesia'), dryRun=1 (só valida), prerender=1 (gera os PDFs).
+    if g.user.get('role') != 'admin':
+        return jsonify({"error": "Acesso não autorizado."}), 403
+    try:
+        event_doc = db.collection('events').document(event_id).get()
+        if not event_doc.exists:
+            return jsonify({"error": "Evento não encontrado."}), 404
+        event_data = dict(event_doc.to_dict(), eventId=event_id)
+        ticket_types = {t['name'].strip().lower(): t for t in event_data.get('ticketTypes', []) if t.get('name')}
+        default_payment_method = request.args.get('paymentMethod', 'Cortesia')
+        dry_run = request.args.get('dryRun') == '1'
+        prerender = request.args.get('prerender') == '1' or PDF_PRERENDER
+        upload = request.files.get('file')
+        stream = upload.stream if upload else request.stream
+        sold_by = g.user.get('name', g.user.get('email'))
+
+        results = []
+        pending = []  # (posição em results, doc_ref, ticket_data)
+        created_tickets = []
+
+        def flush():
+            try:
+                write_tickets_batch(pending)
+                for position, doc_ref, ticket_data in pending:
+                    results[position].update({"success": True, "ticketId": doc_ref.id})
+                    created_tickets.append(ticket_data)
+            except Exception as e:
+                for position, _, _ in pending:
+                    results[position].update({"success": False, "error": f"Erro ao gravar convite: {e}"})
+            pending.clear()
+
+        stopped = None
+        try:
+            for line_number, row in iter_import_rows(stream):
+                if len(results) >= IMPORT_MAX_ROWS:
+                    stopped = f"Importação interrompida: o ficheiro excede o máximo de {IMPORT_MAX_ROWS} linhas."
+                    break
+                result = {"row": line_number, "buyerName": row.get('buyerName', '')}
+                results.append(result)
+                try:
+                    spec = import_row_to_ticket(row, event_data, ticket_types, default_payment_method)
+                except ValueError as e:
+                    result.update({"success": False, "error": str(e)})
+                    continue
+                if dry_run:
+                    result.update({"success": True, "ticketType": spec['ticketType'], "pricePaid": spec['pricePaid']})
+                    continue
+                doc_ref = db.collection('eventTickets').document()
+                pending.append((len(results) - 1, doc_ref, build_ticket_data(doc_ref.id, spec, sold_by)))
+                if len(pending) >= TICKETS_PER_BATCH:
+                    flush()
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            # Cabeçalho inválido ou ficheiro corrompido a meio: os lotes já gravados ficam no relatório
+            if not results:
+                return jsonify({"error": f"CSV inválido: {e}"}), 400
+            stopped = f"CSV inválido depois da linha {results[-1]['row']}: {e}"
+        if pending:
+            flush()
+
+        if prerender and created_tickets:
+            prerender_ticket_pdfs(created_tickets)
+
+        succeeded = sum(1 for r in results if r['success'])
+        return jsonify({
+            "success": succeeded > 0, "dryRun": dry_run, "created": 0 if dry_run else succeeded,
+            "valid": succeeded, "failed": len(results) - succeeded,
+            "ticketIds": [r['ticketId'] for r in results if r.get('ticketId')], "results": results,
+            "error": stopped
+        }), 200 if dry_run else (201 if succeeded else 400)
     except Exception as e:
         return jsonify({"error": f"Erro interno no servidor: {e}"}), 500
 
@@ -214,8 +774,24 @@ def delete_ticket(ticket_id):
     if g.user.get('role') != 'admin':
         return jsonify({"error": "Acesso não autorizado."}), 403
     try:
-        db.collection('eventTickets').document(ticket_id).update({'status': 'EXCLUIDO', 'isDeleted': True})
-        return jsonify({"success": True, "message": "Convite excluído com sucesso."}), 200
+        ticket_ref = db.collection('eventTickets').document(ticket_id)
+        while True:
+            ticket_doc = ticket_ref.get()
+            if not ticket_doc.exists:
+                return jsonify({"error": "Convite não encontrado."}), 404
+            ticket_data = ticket_doc.to_dict()
+            if ticket_data.get('isDeleted'):
+                return jsonify({"success": True, "message": "Convite excluído com sucesso."}), 200
+            checked_in = 1 if ticket_data.get('status') == 'CHECK_IN_REALIZADO' else 0
+            batch = db.batch()
+            batch.update(ticket_ref, {'status': 'EXCLUIDO', 'isDeleted': True, 'updatedAt': firestore.SERVER_TIMESTAMP},
+                         option=db.write_option(last_update_time=ticket_doc.update_time))
+            add_event_stats_writes(batch, accumulate_event_stats({}, ticket_data, sold=-1, checked_in=-checked_in, deleted=1))
+            try:
+                batch.commit()
+            except api_exceptions.FailedPrecondition:
+                continue  # O convite mudou (ex.: check-in) entre a leitura e a escrita
+            return jsonify({"success": True, "message": "Convite excluído com sucesso."}), 200
     except Exception as e:
         return jsonify({"error": f"Erro ao excluir convite: {e}"}), 500
 
@@ -228,95 +804,526 @@ def scan_ticket():
         if not ticket_id:
             return jsonify({"error": "ID do convite em falta."}), 400
         ticket_ref = db.collection('eventTickets').document(ticket_id)
-        ticket_doc = ticket_ref.get()
-        if not ticket_doc.exists:
-            return jsonify({"status": "error", "message": "Convite Inválido"}), 200
-        ticket_data = ticket_doc.to_dict()
-        if ticket_data.get('isDeleted'):
-            return jsonify({"status": "error", "message": "Convite Excluído"}), 200
-        if ticket_data.get('status') == 'CHECK_IN_REALIZADO':
-            checkin_time = ticket_data.get('checkInTimestamp').strftime('%H:%M:%S') if ticket_data.get('checkInTimestamp') else ''
-            scanned_by = ticket_data.get('scannedBy', 'Desconhecido')
-            return jsonify({"status": "warning", "message": f"Convite Já Utilizado às {checkin_time} por {scanned_by}"}), 200
-        ticket_ref.update({
-            'status': 'CHECK_IN_REALIZADO', 'checkInTimestamp': firestore.SERVER_TIMESTAMP,
-            'scannedBy': g.user.get('name', g.user.get('email'))
-        })
-        return jsonify({"status": "success", "message": "Entrada Liberada", "buyerName": ticket_data.get('buyerName')}), 200
+        scanned_by = g.user.get('name', g.user.get('email'))
+        while True:
+            ticket_doc = ticket_ref.get()
+            blocked = scan_block_response(ticket_doc)
+            if blocked:
+                return jsonify(blocked), 200
+            # Só grava se o documento não mudou desde a leitura: se outra porta validou o mesmo
+            # convite entretanto, a pré-condição falha e voltamos a ler para devolver o aviso.
+            batch = db.batch()
+            batch.update(ticket_ref, {
+                'status': 'CHECK_IN_REALIZADO', 'checkInTimestamp': firestore.SERVER_TIMESTAMP,
+                'scannedBy': scanned_by, 'updatedAt': firestore.SERVER_TIMESTAMP
+            }, option=db.write_option(last_update_time=ticket_doc.update_time))
+            add_event_stats_writes(batch, accumulate_event_stats({}, ticket_doc.to_dict(), checked_in=1))
+            try:
+                batch.commit()
+            except api_exceptions.FailedPrecondition:
+                continue
+            return jsonify({"status": "success", "message": "Entrada Liberada", "buyerName": ticket_doc.to_dict().get('buyerName')}), 200
     except Exception as e:
         return jsonify({"error": f"Erro no sistema: {e}"}), 500
 
+def scan_block_response(ticket_doc):
+    # Devolve a resposta de recusa da validação, ou None se o convite pode entrar
+    if not ticket_doc.exists:
+        return {"status": "error", "message": "Convite Inválido"}
+    ticket_data = ticket_doc.to_dict()
+    if ticket_data.get('isDeleted'):
+        return {"status": "error", "message": "Convite Excluído"}
+    if ticket_data.get('status') == 'CHECK_IN_REALIZADO':
+        checkin_time = ticket_data.get('checkInTimestamp').strftime('%H:%M:%S') if ticket_data.get('checkInTimestamp') else ''
+        scanned_by = ticket_data.get('scannedBy', 'Desconhecido')
+        return {"status": "warning", "message": f"Convite Já Utilizado às {checkin_time} por {scanned_by}"}
+    return None
+
+# --- Manifesto do evento e sincronização de check-ins offline ---
+# O validador descarrega o manifesto antes de abrir as portas e valida localmente;
+# os check-ins feitos sem rede são enviados depois em lote para /scan-sync.
+MANIFEST_FIELDS = ['ticketId', 'status', 'isDeleted', 'buyerName', 'ticketType', 'updatedAt']
+
+def timestamp_to_ms(value):
+    return int(value.timestamp() * 1000) if value else 0
+
+def ms_to_datetime(value):
+    # Valores fora do intervalo suportado (OverflowError/OSError) também são um ValueError para quem chama
+    try:
+        return datetime.fromtimestamp(int(value) / 1000, tz=timezone.utc)
+    except (OverflowError, OSError) as e:
+        raise ValueError(f"Data fora do intervalo: {value}") from e
+
+@app.route('/api/events/<event_id>/manifest', methods=['GET'])
+@check_token
+def get_event_manifest(event_id):
+    try:
+        since = request.args.get('since')
+        query = db.collection('eventTickets').where('eventId', '==', event_id)
+        if since:
+            # Modo delta: apenas convites alterados desde o cursor (índice composto eventId + updatedAt)
+            query = query.where('updatedAt', '>=', ms_to_datetime(since))
+        cursor = int(since) if since else 0
+        tickets_list = []
+        for t in query.select(MANIFEST_FIELDS).stream():
+            ticket_data = t.to_dict()
+            cursor = max(cursor, timestamp_to_ms(ticket_data.get('updatedAt')))
+            tickets_list.append({
+                'ticketId': ticket_data.get('ticketId', t.id),
+                'status': 'EXCLUIDO' if ticket_data.get('isDeleted') else ticket_data.get('status'),
+                'buyerName': ticket_data.get('buyerName'),
+                'ticketType': ticket_data.get('ticketType')
+            })
+        return jsonify({"eventId": event_id, "full": not since, "cursor": cursor, "tickets": tickets_list}), 200
+    except ValueError:
+        return jsonify({"error": "Cursor 'since' inválido."}), 400
+    except Exception as e:
+        return jsonify({"error": f"Erro ao gerar manifesto: {e}"}), 500
+
+def offline_check_in_block(index, check_in, snap, claimed):
+    # Devolve o resultado de recusa (ou de reenvio idempotente) de um check-in offline, ou None se pode ser gravado
+    ticket_id, scan_id = check_in['ticketId'], check_in['scanId']
+    if snap is None or not snap.exists:
+        return {"index": index, "ticketId": ticket_id, "status": "error", "message": "Convite Inválido"}
+    ticket_data = snap.to_dict()
+    if ticket_data.get('isDeleted'):
+        return {"index": index, "ticketId": ticket_id, "status": "error", "message": "Convite Excluído"}
+    if ticket_data.get('status') == 'CHECK_IN_REALIZADO' or ticket_id in claimed:
+        if ticket_data.get('checkInScanId') == scan_id or claimed.get(ticket_id) == scan_id:
+            # Reenvio do mesmo check-in: idempotente
+            return {"index": index, "ticketId": ticket_id, "status": "success", "message": "Já sincronizado"}
+        return {
+            "index": index, "ticketId": ticket_id, "status": "conflict",
+            "message": "Entrada dupla", "scannedBy": ticket_data.get('scannedBy'),
+            "gate": ticket_data.get('checkInGate'),
+            "checkInTimestamp": timestamp_to_ms(ticket_data.get('checkInTimestamp'))
+        }
+    return None
+
+def offline_check_in_update(check_in, scanned_by):
+    scanned_at = check_in.get('scannedAt')
+    return {
+        'status': 'CHECK_IN_REALIZADO',
+        'checkInTimestamp': ms_to_datetime(scanned_at) if scanned_at else firestore.SERVER_TIMESTAMP,
+        'scannedBy': scanned_by, 'checkInGate': check_in.get('gate'), 'checkInScanId': check_in['scanId'],
+        'updatedAt': firestore.SERVER_TIMESTAMP
+    }
+
+def offline_check_in_success(index, check_in, snap):
+    return {"index": index, "ticketId": check_in['ticketId'], "status": "success", "message": "Entrada Liberada",
+            "buyerName": snap.to_dict().get('buyerName')}
+
+@app.route('/api/event/ticket/scan-sync', methods=['POST'])
+@check_token
+def sync_offline_scans():
+    try:
+        data = request.get_json()
+        check_ins = data.get('checkIns') if data else None
+        if not isinstance(check_ins, list) or len(check_ins) == 0:
+            return jsonify({"error": "Uma lista 'checkIns' é obrigatória."}), 400
+        if len(check_ins) > TICKETS_PER_BATCH:
+            return jsonify({"error": f"Máximo de {TICKETS_PER_BATCH} check-ins por sincronização."}), 400
+
+        scanned_by = g.user.get('name', g.user.get('email'))
+        results = [None] * len(check_ins)
+        valid = []  # (índice, check_in)
+        for index, check_in in enumerate(check_ins):
+            if not isinstance(check_in, dict) or not check_in.get('ticketId') or not check_in.get('scanId'):
+                results[index] = {"index": index, "status": "error", "message": "ticketId e scanId são obrigatórios."}
+            else:
+                valid.append((index, check_in))
+
+        # Uma única leitura em lote para todos os convites da fila
+        refs = {c['ticketId']: db.collection('eventTickets').document(c['ticketId']) for _, c in valid}
+        snapshots = {snap.id: snap for snap in db.get_all(list(refs.values()))} if refs else {}
+
+        pending = []  # (índice, check_in, snapshot, update_data)
+        claimed = {}  # ticketId -> scanId já reclamado neste lote
+        for index, check_in in valid:
+            snap = snapshots.get(check_in['ticketId'])
+            blocked = offline_check_in_block(index, check_in, snap, claimed)
+            if blocked:
+                results[index] = blocked
+                continue
+            claimed[check_in['ticketId']] = check_in['scanId']
+            pending.append((index, check_in, snap, offline_check_in_update(check_in, scanned_by)))
+
+        try:
+            # A pré-condição em update_time impede sobrescrever um check-in feito noutra porta entretanto
+            batch = db.batch()
+            stats_totals = {}
+            for _, _, snap, update_data in pending:
+                batch.update(snap.reference, update_data, option=db.write_option(last_update_time=snap.update_time))
+                accumulate_event_stats(stats_totals, snap.to_dict(), checked_in=1)
+            add_event_stats_writes(batch, stats_totals)
+            if pending:
+                batch.commit()
+            for index, check_in, snap, _ in pending:
+                results[index] = offline_check_in_success(index, check_in, snap)
+        except api_exceptions.FailedPrecondition:
+            # Algum convite mudou desde a leitura: aplica um a um e, como no scan_ticket, volta a
+            # ler o convite quando a pré-condição falha para devolver o motivo verdadeiro
+            for index, check_in, snap, update_data in pending:
+                while True:
+                    try:
+                        batch = db.batch()
+                        batch.update(snap.reference, update_data, option=db.write_option(last_update_time=snap.update_time))
+                        add_event_stats_writes(batch, accumulate_event_stats({}, snap.to_dict(), checked_in=1))
+                        batch.commit()
+                        results[index] = offline_check_in_success(index, check_in, snap)
+                        break
+                    except api_exceptions.FailedPrecondition:
+                        snap = snap.reference.get()
+                        blocked = offline_check_in_block(index, check_in, snap, {})
+                        if blocked:
+                            results[index] = blocked
+                            break
+
+        return jsonify({"success": True, "results": results}), 200
+    except ValueError:
+        return jsonify({"error": "Valor 'scannedAt' inválido."}), 400
+    except Exception as e:
+        return jsonify({"error": f"Erro ao sincronizar check-ins: {e}"}), 500
+
+def load_ticket_and_event(ticket_id):
+    ticket_doc = db.collection('eventTickets').document(ticket_id).get()
+    if not ticket_doc.exists:
+        return None, None
+    ticket_data = ticket_doc.to_dict()
+    event_doc = db.collection('events').document(ticket_data['eventId']).get()
+    return ticket_data, event_doc.to_dict() if event_doc.exists else {}
+
 @app.route('/api/event/ticket/<ticket_id>/pdf')
 def generate_ticket_pdf(ticket_id):
     try:
-        ticket_doc = db.collection('eventTickets').document(ticket_id).get()
-        if not ticket_doc.exists: return "Convite não encontrado", 404
-        ticket_data = ticket_doc.to_dict()
-        event_doc = db.collection('events').document(ticket_data['eventId']).get()
-        event_data = event_doc.to_dict() if event_doc.exists else {}
-        if event_data.get('eventDate'):
-            date_obj = datetime.strptime(event_data['eventDate'], '%Y-%m-%d')
-            event_data['eventDateFormatted'] = date_obj.strftime('%d/%m/%Y')
-        qr = qrcode.QRCode(version=1, box_size=4, border=2)
-        qr.add_data(ticket_id)
-        qr.make(fit=True)
-        img = qr.make_image(fill='black', back_color='white')
-        buffered = io.BytesIO()
-        img.save(buffered, format="PNG")
-        qr_code_b64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        html_out = render_template('ticket.html', ticket=ticket_data, event=event_data, qr_code_b64=qr_code_b64)
-        pdf = HTML(string=html_out).write_pdf()
+        ticket_data, event_data = load_ticket_and_event(ticket_id)
+        if ticket_data is None: return "Convite não encontrado", 404
+        pdf = ticket_pdf.get_or_render_pdf(ticket_data, event_data)
         return Response(pdf, mimetype='application/pdf', headers={'Content-Disposition': f'attachment; filename=convite_{ticket_id}.pdf'})
     except Exception as e:
-        print(f"Erro ao gerar PDF: {e}")
+        app.logger.error(f"Erro ao gerar PDF: {e}")
         return "Erro ao gerar PDF", 500
 
+# --- Jobs de renderização de PDF ---
+# POST devolve 202 com o ID do job (ou 200 se o PDF já está em cache); o estado e o
+# download podem ser consultados em qualquer worker. ID do job: "<ticketId>.<chave do cache>".
+PDF_JOB_ID_PATTERN = re.compile(r'^([A-Za-z0-9]+)\.([0-9a-f]{64})$')
+
+def pdf_job_urls(job_id):
+    return {
+        "statusUrl": request.host_url + f"api/pdf-jobs/{job_id}",
+        "downloadUrl": request.host_url + f"api/pdf-jobs/{job_id}/download"
+    }
+
+@app.route('/api/pdf-jobs', methods=['POST'])
+def create_pdf_job():
+    try:
+        data = request.get_json()
+        ticket_id = data.get('ticketId') if data else None
+        if not ticket_id:
+            return jsonify({"error": "ID do convite em falta."}), 400
+        ticket_data, event_data = load_ticket_and_event(ticket_id)
+        if ticket_data is None:
+            return jsonify({"error": "Convite não encontrado."}), 404
+        priority = ticket_pdf.PRIORITY_BULK if data.get('bulk') else ticket_pdf.PRIORITY_INTERACTIVE
+        key = ticket_pdf.submit_render_job(ticket_data, event_data, priority)
+        job_id = f"{ticket_id}.{key}"
+        status = ticket_pdf.job_status(key)
+        return jsonify({"jobId": job_id, "status": status, **pdf_job_urls(job_id)}), 200 if status == 'done' else 202
+    except Exception as e:
+        return jsonify({"error": f"Erro ao criar job de PDF: {e}"}), 500
+
+@app.route('/api/pdf-jobs/<job_id>', methods=['GET'])
+def get_pdf_job(job_id):
+    match = PDF_JOB_ID_PATTERN.match(job_id)
+    if not match:
+        return jsonify({"error": "Job não encontrado."}), 404
+    status = ticket_pdf.job_status(match.group(2))
+    if status == 'unknown':
+        return jsonify({"error": "Job não encontrado."}), 404
+    return jsonify({"jobId": job_id, "status": status, **pdf_job_urls(job_id)}), 200
+
+@app.route('/api/pdf-jobs/<job_id>/download', methods=['GET'])
+def download_pdf_job(job_id):
+    match = PDF_JOB_ID_PATTERN.match(job_id)
+    if not match:
+        return jsonify({"error": "Job não encontrado."}), 404
+    ticket_id, key = match.groups()
+    pdf = ticket_pdf.get_cached_pdf(key)
+    if pdf is not None:
+        return Response(pdf, mimetype='application/pdf', headers={'Content-Disposition': f'attachment; filename=convite_{ticket_id}.pdf'})
+    status = ticket_pdf.job_status(key)
+    if status == 'pending':
+        return jsonify({"jobId": job_id, "status": status, **pdf_job_urls(job_id)}), 202
+    return jsonify({"error": "Job não encontrado." if status == 'unknown' else "Erro ao gerar PDF."}), 404 if status == 'unknown' else 500
+
+@app.route('/api/events/<event_id>/stats', methods=['GET'])
+@check_token
+def get_event_stats(event_id):
+    try:
+        return jsonify(load_event_stats(event_id)), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro ao buscar estatísticas do evento: {e}"}), 500
+
+@app.route('/api/events/<event_id>/tickets/pdf-bundle')
+@check_token
+def export_event_tickets_pdf_bundle(event_id):
+    if g.user.get('role') != 'admin':
+        return jsonify({"error": "Acesso não autorizado."}), 403
+    try:
+        event_doc = db.collection('events').document(event_id).get()
+        if not event_doc.exists:
+            return jsonify({"error": "Evento não encontrado."}), 404
+        event_data = event_doc.to_dict()
+        # Só os campos que aparecem no convite: a lista de 3.000 convites fica pequena
+        tickets_ref = db.collection('eventTickets').where('eventId', '==', event_id).select(ticket_pdf.TICKET_RENDER_FIELDS + ['isDeleted']).stream()
+        tickets_list = [t.to_dict() for t in tickets_ref]
+        tickets_list = [t for t in tickets_list if not t.get('isDeleted')]
+        filename = f"convites_{event_data.get('eventName', 'evento').replace(' ', '_')}.zip"
+        return Response(ticket_pdf.stream_pdf_zip(tickets_list, event_data), mimetype='application/zip',
+                        headers={"Content-Disposition": f"attachment; filename={filename}"})
+    except Exception as e:
+        app.logger.error(f"Erro ao gerar pacote de PDFs: {e}")
+        return jsonify({"error": f"Erro ao gerar pacote de PDFs: {e}"}), 500
+
+# Filtros de igualdade da listagem; os índices compostos eventId + filtro(s) + purchaseDate estão em firestore.indexes.json
+TICKET_LIST_FILTERS = ('status', 'ticketType', 'soldBy')
+
 @app.route('/api/events/<event_id>/tickets', methods=['GET'])
 @check_token
 def get_event_tickets(event_id):
     try:
-        tickets_ref = db.collection('eventTickets').where('eventId', '==', event_id).stream()
-        tickets_list = [t.to_dict() for t in tickets_ref]
-        tickets_list.sort(key=lambda x: x.get('purchaseDate'), reverse=True)
-        return jsonify(tickets_list), 200
+        filters = [field for field in TICKET_LIST_FILTERS if request.args.get(field)]
+        buyer_prefix = request.args.get('buyerName')
+        if buyer_prefix and len(filters) > 1:
+            # Só existem índices compostos para buyerName com um dos outros filtros (firestore.indexes.json)
+            return jsonify({"error": "A pesquisa por nome só pode ser combinada com um dos filtros status, ticketType ou soldBy."}), 400
+        query = db.collection('eventTickets').where('eventId', '==', event_id)
+        for field in filters:
+            query = query.where(field, '==', request.args[field])
+        if buyer_prefix:
+            # Pesquisa por prefixo: o Firestore exige ordenar primeiro pelo campo do intervalo
+            query = query.where('buyerName', '>=', buyer_prefix).where('buyerName', '<', buyer_prefix + '\uf8ff')
+            query = query.order_by('buyerName')
+        query = query.order_by('purchaseDate', direction=firestore.Query.DESCENDING)
+        return paginated_response('eventTickets', query)
+    except InvalidCursor:
+        return invalid_cursor_response()
     except Exception as e:
         return jsonify({"error": f"Erro ao buscar convites do evento: {e}"}), 500
 
+TICKET_EXPORT_HEADER = ['Data Venda', 'Comprador', 'Telefone', 'Tipo Convite', 'Preco', 'Metodo Pagamento', 'Vendido Por', 'Estado', 'Data CheckIn', 'Validado Por']
+
+def ticket_export_row(ticket_data, for_spreadsheet=False):
+    purchase_date = ticket_data.get('purchaseDate').strftime('%d/%m/%Y %H:%M:%S') if ticket_data.get('purchaseDate') else ''
+    checkin_date = ticket_data.get('checkInTimestamp').strftime('%d/%m/%Y %H:%M:%S') if ticket_data.get('checkInTimestamp') else ''
+    price = ticket_data.get('pricePaid', 0)
+    return [
+        purchase_date, ticket_data.get('buyerName', ''), ticket_data.get('buyerPhone', ''),
+        ticket_data.get('ticketType', ''), price if for_spreadsheet else str(price).replace('.',','),
+        ticket_data.get('paymentMethod', ''), ticket_data.get('soldBy', ''),
+        ticket_data.get('status', ''), checkin_date, ticket_data.get('scannedBy', '')
+    ]
+
 @app.route('/api/events/<event_id>/tickets/export')
 @check_token
 def export_event_tickets_csv(event_id):
     if g.user.get('role') != 'admin':
         return jsonify({"error": "Acesso não autorizado."}), 403
     try:
+        export_format = request.args.get('format', 'csv')
+        if export_format not in ('csv', 'xlsx'):
+            return jsonify({"error": "Formato inválido. Use 'csv' ou 'xlsx'."}), 400
         event_doc = db.collection('events').document(event_id).get()
         event_name = event_doc.to_dict().get('eventName', 'evento') if event_doc.exists else 'evento'
-        filename = f"relatorio_vendas_{event_name.replace(' ', '_')}.csv"
-        tickets_ref = db.collection('eventTickets').where('eventId', '==', event_id).stream()
-        def generate_csv():
-            output = io.StringIO()
-            writer = csv.writer(output)
-            writer.writerow(['Data Venda', 'Comprador', 'Telefone', 'Tipo Convite', 'Preco', 'Metodo Pagamento', 'Vendido Por', 'Estado', 'Data CheckIn', 'Validado Por'])
-            tickets_list = sorted([t.to_dict() for t in tickets_ref], key=lambda x: x.get('purchaseDate'), reverse=False)
-            for ticket_data in tickets_list:
-                purchase_date = ticket_data.get('purchaseDate').strftime('%d/%m/%Y %H:%M:%S') if ticket_data.get('purchaseDate') else ''
-                checkin_date = ticket_data.get('checkInTimestamp').strftime('%d/%m/%Y %H:%M:%S') if ticket_data.get('checkInTimestamp') else ''
-                writer.writerow([
-                    purchase_date, ticket_data.get('buyerName', ''), ticket_data.get('buyerPhone', ''),
-                    ticket_data.get('ticketType', ''), str(ticket_data.get('pricePaid', 0)).replace('.',','), 
-                    ticket_data.get('paymentMethod', ''), ticket_data.get('soldBy', ''), 
-                    ticket_data.get('status', ''), checkin_date, ticket_data.get('scannedBy', '')
-                ])
-            output.seek(0)
-            return output.getvalue()
-        csv_data = generate_csv().encode('utf-8-sig')
-        return Response(csv_data, mimetype='text/csv', headers={"Content-Disposition": f"attachment; filename={filename}"})
-    except Exception as e:
-        print(f"Erro ao gerar CSV: {e}")
+        filename = f"relatorio_vendas_{event_name.replace(' ', '_')}.{export_format}"
+        # Índice composto eventId + purchaseDate: a ordenação fica do lado do Firestore
+        query = db.collection('eventTickets').where('eventId', '==', event_id).order_by('purchaseDate')
+        headers = {"Content-Disposition": f"attachment; filename={filename}"}
+        tickets = prefetch_query_pages(query)
+        if export_format == 'xlsx':
+            rows = (ticket_export_row(t.to_dict(), for_spreadsheet=True) for t in tickets)
+            return Response(exports.iter_xlsx(TICKET_EXPORT_HEADER, rows, sheet_name='Vendas'),
+                            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', headers=headers)
+        rows = (ticket_export_row(t.to_dict()) for t in tickets)
+        return Response(exports.iter_csv(TICKET_EXPORT_HEADER, rows), mimetype='text/csv', headers=headers)
+    except Exception as e:
+        app.logger.error(f"Erro ao gerar CSV: {e}")
         return f"Erro ao gerar CSV: {e}", 500
 
 # ===================================================================
 # ROTAS DA API - MÓDULO DE MARKETING
 # ===================================================================
+# --- Cache dos QR Codes e contagem de leituras em segundo plano ---
+# O /r/<short_id> é a rota mais usada: serve o documento a partir da memória e acumula
+# os incrementos de scanCount, gravados em lote por uma thread a cada SCAN_FLUSH_INTERVAL.
+_qr_cache = TTLCache(maxsize=QR_CACHE_SIZE, ttl=QR_CACHE_TTL)
+_qr_cache_lock = threading.Lock()
+_pending_scans = {}
+_pending_scans_lock = threading.Lock()
+_scan_flusher = None
+# Registo leve por leitura para as estatísticas por hora/dia (deque limitado: nunca bloqueia)
+_scan_events = deque(maxlen=SCAN_ANALYTICS_QUEUE_SIZE)
+# Baldes cujo lote falhou (voltam no flush seguinte) e origens já gravadas em cada balde
+_unsaved_scan_buckets = {}
+_bucket_referrers = TTLCache(maxsize=SCAN_ANALYTICS_QUEUE_SIZE, ttl=2 * 86400)
+_scan_analytics_lock = threading.Lock()
+
+def get_marketing_qr_cached(short_id):
+    with _qr_cache_lock:
+        qr_data = _qr_cache.get(short_id)
+    if qr_data is not None:
+        return qr_data
+    doc = db.collection('marketingQRs').document(short_id).get()
+    if not doc.exists:
+        return None
+    qr_data = doc.to_dict()
+    with _qr_cache_lock:
+        _qr_cache[short_id] = qr_data
+    return qr_data
+
+def invalidate_marketing_qr(short_id):
+    with _qr_cache_lock:
+        _qr_cache.pop(short_id, None)
+
+def classify_user_agent(user_agent):
+    ua = (user_agent or '').lower()
+    if any(marker in ua for marker in ('bot', 'crawler', 'spider', 'whatsapp', 'facebookexternalhit', 'preview')):
+        return 'bot'
+    if 'ipad' in ua or 'tablet' in ua:
+        return 'tablet'
+    if any(marker in ua for marker in ('mobile', 'android', 'iphone')):
+        return 'mobile'
+    return 'desktop'
+
+SCAN_DIRECT_REFERRER = 'direto'
+SCAN_OTHER_REFERRER = 'outro'
+
+def scan_referrer_key(referrer):
+    # Só o host, em minúsculas e sem caracteres fora de [a-z0-9.-]: vira chave do mapa byReferrer
+    try:
+        host = urlparse(referrer).hostname if referrer else None
+    except ValueError:
+        host = None
+    host = re.sub(r'[^a-z0-9.-]', '', host or '').strip('.')[:64]
+    if host.startswith('www.'):
+        host = host[4:]
+    return host or SCAN_DIRECT_REFERRER
+
+def record_qr_scan(short_id, user_agent=None, referrer=None):
+    global _scan_flusher
+    _scan_events.append((time.time(), short_id, classify_user_agent(user_agent), scan_referrer_key(referrer)))
+    with _pending_scans_lock:
+        _pending_scans[short_id] = _pending_scans.get(short_id, 0) + 1
+        # A thread arranca no primeiro uso, já dentro do worker (depois do fork do Gunicorn)
+        if _scan_flusher is None:
+            _scan_flusher = threading.Thread(target=_scan_flush_loop, daemon=True)
+            _scan_flusher.start()
+
+SCAN_BUCKET_FORMATS = {'hour': '%Y%m%d%H', 'day': '%Y%m%d'}
+
+def _scan_bucket_start(timestamp, granularity):
+    moment = datetime.fromtimestamp(timestamp, tz=timezone.utc)
+    if granularity == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def _add_scan_counts(bucket, source):
+    bucket['scans'] += source['scans']
+    for field in ('byDevice', 'byReferrer'):
+        for key, count in source[field].items():
+            bucket[field][key] = bucket[field].get(key, 0) + count
+
+def _cap_referrers(doc_id, by_referrer):
+    # Mantém as SCAN_REFERRERS_PER_BUCKET origens já gravadas no balde (ou as mais frequentes,
+    # se ainda houver lugar) e junta as restantes em 'outro', para o documento não crescer sem limite
+    known = _bucket_referrers.get(doc_id) or set()
+    capped = {}
+    for referrer, count in sorted(by_referrer.items(), key=lambda item: -item[1]):
+        if referrer not in known:
+            if len(known) >= SCAN_REFERRERS_PER_BUCKET:
+                referrer = SCAN_OTHER_REFERRER
+            else:
+                known.add(referrer)
+        capped[referrer] = capped.get(referrer, 0) + count
+    _bucket_referrers[doc_id] = known
+    return capped
+
+def flush_qr_scan_analytics():
+    # Agrega as leituras em documentos por QR e por hora/dia: uma escrita por balde, não por leitura
+    with _scan_analytics_lock:
+        buckets = dict(_unsaved_scan_buckets)
+        _unsaved_scan_buckets.clear()
+        while True:
+            try:
+                timestamp, short_id, device, referrer = _scan_events.popleft()
+            except IndexError:
+                break
+            for granularity, bucket_format in SCAN_BUCKET_FORMATS.items():
+                bucket_start = _scan_bucket_start(timestamp, granularity)
+                doc_id = f"{short_id}_{granularity}_{bucket_start.strftime(bucket_format)}"
+                bucket = buckets.setdefault(doc_id, {
+                    'shortId': short_id, 'granularity': granularity, 'bucketStart': bucket_start,
+                    'scans': 0, 'byDevice': {}, 'byReferrer': {}
+                })
+                _add_scan_counts(bucket, {'scans': 1, 'byDevice': {device: 1}, 'byReferrer': {referrer: 1}})
+        items = list(buckets.items())
+        error = None
+        for start in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+            chunk = items[start:start + FIRESTORE_BATCH_LIMIT]
+            batch = db.batch()
+            for doc_id, bucket in chunk:
+                batch.set(db.collection('marketingQRStats').document(doc_id), {
+                    'shortId': bucket['shortId'], 'granularity': bucket['granularity'], 'bucketStart': bucket['bucketStart'],
+                    'scans': firestore.Increment(bucket['scans']),
+                    'byDevice': {k: firestore.Increment(v) for k, v in bucket['byDevice'].items()},
+                    'byReferrer': {k: firestore.Increment(v) for k, v in _cap_referrers(doc_id, bucket['byReferrer']).items()}
+                }, merge=True)
+            try:
+                batch.commit()
+            except Exception as e:
+                # Os baldes deste lote voltam para o próximo flush; os lotes seguintes continuam
+                _unsaved_scan_buckets.update(chunk)
+                error = e
+        if error is not None:
+            raise error
+
+def flush_qr_scans():
+    try:
+        flush_qr_scan_analytics()
+    except Exception as e:
+        app.logger.error(f"Erro ao gravar estatísticas dos QR Codes: {e}")
+    with _pending_scans_lock:
+        pending = dict(_pending_scans)
+        _pending_scans.clear()
+    if not pending:
+        return
+    items = list(pending.items())
+    for start in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+        chunk = items[start:start + FIRESTORE_BATCH_LIMIT]
+        batch = db.batch()
+        for short_id, count in chunk:
+            batch.update(db.collection('marketingQRs').document(short_id), {'scanCount': firestore.Increment(count)})
+        try:
+            batch.commit()
+        except Exception:
+            # Um QR excluído entretanto faz falhar o lote inteiro: grava um a um e ignora os que já não existem
+            for short_id, count in chunk:
+                try:
+                    db.collection('marketingQRs').document(short_id).update({'scanCount': firestore.Increment(count)})
+                except Exception as e:
+                    app.logger.error(f"Erro ao gravar leituras do QR {short_id}: {e}")
+
+def _scan_flush_loop():
+    while True:
+        time.sleep(SCAN_FLUSH_INTERVAL)
+        try:
+            flush_qr_scans()
+        except Exception as e:
+            app.logger.error(f"Erro ao gravar leituras dos QR Codes: {e}")
+
+atexit.register(flush_qr_scans)
+
 @app.route('/api/marketing/qr/create', methods=['POST'])
 @check_token
 def create_marketing_qr():
@@ -340,24 +1347,95 @@ def create_marketing_qr():
             qr_data['links'] = data['links']
         else: return jsonify({"error": "Tipo de QR Code inválido."}), 400
         db.collection('marketingQRs').document(short_id).set(qr_data)
+        invalidate_marketing_qr(short_id)
         base_url = request.host_url + 'r/' + short_id
-        return jsonify({ "success": True, "message": "QR Code criado com sucesso!", "shortId": short_id, "qrCodeUrl": base_url }), 201
+        return jsonify({
+            "success": True, "message": "QR Code criado com sucesso!", "shortId": short_id, "qrCodeUrl": base_url,
+            "qrImageSvgUrl": qr_image_url(base_url, 'svg'), "qrImagePngUrl": qr_image_url(base_url, 'png')
+        }), 201
     except Exception as e:
         return jsonify({"error": f"Erro interno no servidor: {e}"}), 500
 
+# --- Leads ---
+# Um documento por email (id = hash do email normalizado): reenviar o formulário atualiza
+# o mesmo lead. leadStats/<sourceQrId> guarda as contagens por QR, mantidas a cada registo.
+LEAD_EXPORT_HEADER = ['Data', 'Nome', 'Email', 'Telefone', 'Cidade', 'Origem (ID do QR)', 'Origens', 'Envios', 'Ultimo Envio']
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+def lead_id_for_email(email):
+    return hashlib.sha256(normalize_email(email).encode('utf-8')).hexdigest()[:40]
+
+# sourceQrId vem do formulário público e é usado como ID do documento leadStats
+SOURCE_QR_ID_PATTERN = re.compile(r'^[A-Za-z0-9]{1,32}$')
+
+def valid_source_qr_id(source_qr_id):
+    return isinstance(source_qr_id, str) and SOURCE_QR_ID_PATTERN.match(source_qr_id) is not None
+
+def add_lead_stats_writes(batch, source_qr_id, new_lead):
+    stats = {'sourceQrId': source_qr_id, 'submissionCount': firestore.Increment(1), 'lastLeadAt': firestore.SERVER_TIMESTAMP}
+    if new_lead:
+        stats['leadCount'] = firestore.Increment(1)
+    batch.set(db.collection('leadStats').document(source_qr_id), stats, merge=True)
+
+def leads_query():
+    # Filtros comuns à listagem e à exportação: ?sourceQrId= e intervalo ?from=&to= (ms, hora da captação)
+    query = db.collection('leads')
+    source_qr_id = request.args.get('sourceQrId')
+    if source_qr_id:
+        query = query.where('sourceQrIds', 'array_contains', source_qr_id)
+    if request.args.get('from'):
+        query = query.where('timestamp', '>=', ms_to_datetime(request.args['from']))
+    if request.args.get('to'):
+        query = query.where('timestamp', '<', ms_to_datetime(request.args['to']))
+    return query.order_by('timestamp', direction=firestore.Query.DESCENDING)
+
+def lead_export_row(lead_data):
+    def fmt(value):
+        return value.strftime('%d/%m/%Y %H:%M:%S') if value else ''
+    return [
+        fmt(lead_data.get('timestamp')), lead_data.get('name', ''), lead_data.get('email', ''),
+        lead_data.get('phone') or '', lead_data.get('city') or '', lead_data.get('sourceQrId', ''),
+        ' '.join(lead_data.get('sourceQrIds', [])), lead_data.get('submissionCount', 1), fmt(lead_data.get('lastSubmittedAt'))
+    ]
+
 @app.route('/api/leads/register', methods=['POST'])
 def register_lead():
     try:
         data = request.get_json()
         required_fields = ['name', 'email', 'sourceQrId']
         if not all(field in data for field in required_fields): return jsonify({"error": "Dados incompletos."}), 400
-        lead_data = {
-            'name': data['name'], 'email': data['email'], 'phone': data.get('phone'),
-            'city': data.get('city'), 'sourceQrId': data['sourceQrId'],
-            'timestamp': firestore.SERVER_TIMESTAMP
-        }
-        db.collection('leads').add(lead_data)
-        return jsonify({"success": True, "message": "Cadastro realizado com sucesso!"}), 201
+        email = normalize_email(data['email'])
+        if '@' not in email: return jsonify({"error": "Email inválido."}), 400
+        source_qr_id = data['sourceQrId']
+        if not valid_source_qr_id(source_qr_id): return jsonify({"error": "sourceQrId inválido."}), 400
+        contact = {field: data[field] for field in ('phone', 'city') if data.get(field)}
+        lead_ref = db.collection('leads').document(lead_id_for_email(email))
+        while True:
+            lead_doc = lead_ref.get()
+            batch = db.batch()
+            if lead_doc.exists:
+                # Reenvio: atualiza o contacto sem criar outro lead; só conta para o QR se for uma origem nova
+                new_source = source_qr_id not in lead_doc.to_dict().get('sourceQrIds', [])
+                batch.update(lead_ref, {
+                    'name': data['name'], **contact, 'sourceQrIds': firestore.ArrayUnion([source_qr_id]),
+                    'submissionCount': firestore.Increment(1), 'lastSubmittedAt': firestore.SERVER_TIMESTAMP
+                }, option=db.write_option(last_update_time=lead_doc.update_time))
+            else:
+                new_source = True
+                batch.create(lead_ref, {
+                    'name': data['name'], 'email': email, 'phone': data.get('phone'), 'city': data.get('city'),
+                    'sourceQrId': source_qr_id, 'sourceQrIds': [source_qr_id], 'submissionCount': 1,
+                    'timestamp': firestore.SERVER_TIMESTAMP, 'lastSubmittedAt': firestore.SERVER_TIMESTAMP
+                })
+            add_lead_stats_writes(batch, source_qr_id, new_source)
+            try:
+                batch.commit()
+            except (api_exceptions.FailedPrecondition, api_exceptions.AlreadyExists):
+                # Outro envio do mesmo email entrou entre a leitura e a escrita
+                continue
+            return jsonify({"success": True, "message": "Cadastro realizado com sucesso!"}), 201
     except Exception as e:
         return jsonify({"error": f"Erro ao registrar lead: {e}"}), 500
 
@@ -367,21 +1445,122 @@ def get_leads():
     if g.user.get('role') != 'admin':
         return jsonify({"error": "Acesso não autorizado."}), 403
     try:
-        leads_ref = db.collection('leads').order_by('timestamp', direction=firestore.Query.DESCENDING).stream()
-        leads_list = [lead.to_dict() for lead in leads_ref]
-        return jsonify(leads_list), 200
+        query = leads_query()
+        return paginated_response('leads', query)
+    except InvalidCursor:
+        return invalid_cursor_response()
+    except ValueError:
+        return jsonify({"error": "Intervalo 'from'/'to' inválido (use milissegundos)."}), 400
     except Exception as e:
         return jsonify({"error": f"Erro ao buscar leads: {e}"}), 500
 
+@app.route('/api/leads/export')
+@check_token
+def export_leads_csv():
+    if g.user.get('role') != 'admin':
+        return jsonify({"error": "Acesso não autorizado."}), 403
+    try:
+        query = leads_query()
+    except ValueError:
+        return jsonify({"error": "Intervalo 'from'/'to' inválido (use milissegundos)."}), 400
+    try:
+        source_qr_id = request.args.get('sourceQrId')
+        filename = f"leads_{source_qr_id}.csv" if source_qr_id else "leads.csv"
+        rows = (lead_export_row(lead.to_dict()) for lead in prefetch_query_pages(query))
+        return Response(exports.iter_csv(LEAD_EXPORT_HEADER, rows), mimetype='text/csv',
+                        headers={"Content-Disposition": f"attachment; filename={filename}"})
+    except Exception as e:
+        app.logger.error(f"Erro ao gerar CSV: {e}")
+        return f"Erro ao gerar CSV: {e}", 500
+
+@app.route('/api/leads/stats', methods=['GET'])
+@check_token
+def get_lead_stats():
+    if g.user.get('role') != 'admin':
+        return jsonify({"error": "Acesso não autorizado."}), 403
+    try:
+        source_qr_id = request.args.get('sourceQrId')
+        if source_qr_id:
+            stats_doc = db.collection('leadStats').document(source_qr_id).get()
+            stats = stats_doc.to_dict() if stats_doc.exists else {'sourceQrId': source_qr_id, 'leadCount': 0, 'submissionCount': 0}
+            return jsonify(stats), 200
+        stats_list = [doc.to_dict() for doc in db.collection('leadStats').order_by('leadCount', direction=firestore.Query.DESCENDING).stream()]
+        return jsonify(stats_list), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro ao buscar estatísticas de leads: {e}"}), 500
+
+def rebuild_leads():
+    # Junta os leads antigos (um documento por envio) no documento do respetivo email
+    # e recalcula leadStats de raiz
+    merged = 0
+    for doc in iter_query_pages(db.collection('leads').order_by('timestamp')):
+        lead_data = doc.to_dict()
+        lead_id = lead_id_for_email(lead_data.get('email'))
+        if doc.id == lead_id or not normalize_email(lead_data.get('email')):
+            continue
+        lead_ref = db.collection('leads').document(lead_id)
+        source_qr_id = lead_data.get('sourceQrId')
+        legacy_time = lead_data.get('timestamp')
+        while True:
+            existing = lead_ref.get()
+            batch = db.batch()
+            if existing.exists:
+                # O documento novo pode ter envios posteriores ao deploy: o envio antigo só conta
+                # para a primeira captação e só substitui o contacto se for mais recente
+                current = existing.to_dict()
+                update = {'submissionCount': firestore.Increment(1)}
+                if source_qr_id:
+                    update['sourceQrIds'] = firestore.ArrayUnion([source_qr_id])
+                first_time = min((t for t in (current.get('timestamp'), legacy_time) if t is not None), default=None)
+                if first_time is not None:
+                    update['timestamp'] = first_time
+                last_time = current.get('lastSubmittedAt')
+                if legacy_time is not None and (last_time is None or legacy_time > last_time):
+                    update['lastSubmittedAt'] = legacy_time
+                    update.update({field: lead_data[field] for field in ('name', 'phone', 'city') if lead_data.get(field)})
+                batch.update(lead_ref, update, option=db.write_option(last_update_time=existing.update_time))
+            else:
+                batch.create(lead_ref, dict(lead_data, email=normalize_email(lead_data.get('email')),
+                                            sourceQrIds=[source_qr_id] if source_qr_id else [],
+                                            submissionCount=1, lastSubmittedAt=legacy_time))
+            batch.delete(doc.reference)
+            try:
+                batch.commit()
+            except (api_exceptions.FailedPrecondition, api_exceptions.AlreadyExists):
+                # Um envio pelo formulário entrou entre a leitura e a escrita
+                continue
+            break
+        merged += 1
+    totals = {}
+    for doc in iter_query_pages(db.collection('leads').select(['sourceQrIds', 'submissionCount']).order_by('__name__')):
+        lead_data = doc.to_dict()
+        for source_qr_id in lead_data.get('sourceQrIds', []):
+            stats = totals.setdefault(source_qr_id, {'sourceQrId': source_qr_id, 'leadCount': 0, 'submissionCount': 0})
+            stats['leadCount'] += 1
+        if lead_data.get('sourceQrIds'):
+            # Os envios repetidos não guardam a origem de cada envio: ficam atribuídos à primeira origem
+            totals[lead_data['sourceQrIds'][0]]['submissionCount'] += lead_data.get('submissionCount', 1)
+            for source_qr_id in lead_data['sourceQrIds'][1:]:
+                totals[source_qr_id]['submissionCount'] += 1
+    # Leads antigos, anteriores à validação, podem ter origens que não servem de ID de documento
+    totals = {source_qr_id: stats for source_qr_id, stats in totals.items() if valid_source_qr_id(source_qr_id)}
+    for start in range(0, len(totals), FIRESTORE_BATCH_LIMIT):
+        batch = db.batch()
+        for stats in list(totals.values())[start:start + FIRESTORE_BATCH_LIMIT]:
+            batch.set(db.collection('leadStats').document(stats['sourceQrId']), dict(stats, updatedAt=firestore.SERVER_TIMESTAMP), merge=True)
+        batch.commit()
+    return merged, totals
+
 @app.route('/api/marketing/qrs', methods=['GET'])
 @check_token
 def get_marketing_qrs():
     if g.user.get('role') != 'admin':
         return jsonify({"error": "Acesso não autorizado."}), 403
     try:
-        qrs_ref = db.collection('marketingQRs').order_by('createdAt', direction=firestore.Query.DESCENDING).stream()
-        qrs_list = [qr.to_dict() for qr in qrs_ref]
-        return jsonify(qrs_list), 200
+        query = db.collection('marketingQRs').order_by('createdAt', direction=firestore.Query.DESCENDING)
+        return paginated_response('marketingQRs', query)
+    except InvalidCursor:
+        return invalid_cursor_response()
     except Exception as e:
         return jsonify({"error": f"Erro ao buscar QR Codes: {e}"}), 500
 
@@ -399,6 +1578,29 @@ def get_single_marketing_qr(short_id):
     except Exception as e:
         return jsonify({"error": f"Erro ao buscar QR Code: {e}"}), 500
 
+@app.route('/api/marketing/qr/<short_id>/stats', methods=['GET'])
+@check_token
+def get_marketing_qr_stats(short_id):
+    if g.user.get('role') != 'admin':
+        return jsonify({"error": "Acesso não autorizado."}), 403
+    try:
+        granularity = request.args.get('granularity', 'hour')
+        if granularity not in SCAN_BUCKET_FORMATS:
+            return jsonify({"error": "Granularidade inválida. Use 'hour' ou 'day'."}), 400
+        limit = max(1, min(request.args.get('limit', 48 if granularity == 'hour' else 30, type=int), MAX_PAGE_SIZE))
+        query = (db.collection('marketingQRStats').where('shortId', '==', short_id).where('granularity', '==', granularity)
+                 .order_by('bucketStart', direction=firestore.Query.DESCENDING).limit(limit))
+        buckets = []
+        for doc in query.stream():
+            bucket = doc.to_dict()
+            buckets.append({
+                'bucketStart': bucket['bucketStart'].isoformat(), 'scans': bucket.get('scans', 0),
+                'byDevice': bucket.get('byDevice', {}), 'byReferrer': bucket.get('byReferrer', {})
+            })
+        return jsonify({"shortId": short_id, "granularity": granularity, "buckets": buckets}), 200
+    except Exception as e:
+        return jsonify({"error": f"Erro ao buscar estatísticas do QR Code: {e}"}), 500
+
 @app.route('/api/marketing/qr/update/<short_id>', methods=['PUT'])
 @check_token
 def update_marketing_qr(short_id):
@@ -410,6 +1612,7 @@ def update_marketing_qr(short_id):
         db.collection('marketingQRs').document(short_id).update({
             'title': data['title'], 'destinationUrl': data['destinationUrl']
         })
+        invalidate_marketing_qr(short_id)
         return jsonify({"success": True, "message": "QR Code atualizado com sucesso."}), 200
     except Exception as e:
         return jsonify({"error": f"Erro ao atualizar QR Code: {e}"}), 500
@@ -421,6 +1624,9 @@ def delete_marketing_qr(short_id):
         return jsonify({"error": "Acesso não autorizado."}), 403
     try:
         db.collection('marketingQRs').document(short_id).delete()
+        invalidate_marketing_qr(short_id)
+        with _pending_scans_lock:
+            _pending_scans.pop(short_id, None)
         return jsonify({"success": True, "message": f"QR Code {short_id} excluído com sucesso."}), 200
     except Exception as e:
         return jsonify({"error": f"Erro ao excluir QR Code: {e}"}), 500
@@ -428,11 +1634,9 @@ def delete_marketing_qr(short_id):
 @app.route('/r/<short_id>')
 def redirect_and_track(short_id):
     try:
-        doc_ref = db.collection('marketingQRs').document(short_id)
-        doc = doc_ref.get()
-        if not doc.exists: return "URL não encontrada.", 404
-        doc_ref.update({'scanCount': firestore.Increment(1)})
-        qr_data = doc.to_dict()
+        qr_data = get_marketing_qr_cached(short_id)
+        if qr_data is None: return "URL não encontrada.", 404
+        record_qr_scan(short_id, request.headers.get('User-Agent'), request.referrer)
         if qr_data.get('type') == 'linkpage':
             lead_capture_config = qr_data.get('leadCapture', {'enabled': False})
             return render_template('linkpage.html', qr_data=qr_data, lead_capture=lead_capture_config)
@@ -444,6 +1648,100 @@ def redirect_and_track(short_id):
     except Exception as e:
         return f"Ocorreu um erro: {e}", 500
 
+# ===================================================================
+# ROTAS DA API - IMAGENS DE QR CODE
+# ===================================================================
+def qr_image_url(payload, fmt='svg'):
+    return request.host_url + f"api/qr/{quote(payload, safe='')}.{fmt}"
+
+# merge_slashes=False: o conteúdo pode ser um URL completo (https://...)
+@app.route('/api/qr/<path:filename>', merge_slashes=False)
+def get_qr_image(filename):
+    payload, _, fmt = filename.rpartition('.')
+    if not payload or fmt not in qr_render.QR_FORMATS:
+        return jsonify({"error": "Use /api/qr/<conteúdo>.svg ou /api/qr/<conteúdo>.png"}), 404
+    if len(payload) > qr_render.QR_MAX_PAYLOAD:
+        return jsonify({"error": f"Conteúdo do QR Code maior que {qr_render.QR_MAX_PAYLOAD} caracteres."}), 414
+    try:
+        size = qr_render.clamp_size(request.args.get('size', 4 if fmt == 'svg' else 10, type=int))
+        try:
+            image = qr_render.render_qr(payload, size, fmt)
+        except ValueError as e:
+            # Ex.: conteúdo que não cabe em nenhuma versão de QR Code
+            return jsonify({"error": f"Conteúdo inválido para QR Code: {e}"}), 400
+        response = Response(image, mimetype=qr_render.QR_FORMATS[fmt])
+        # O conteúdo depende só do URL: navegadores e CDNs podem guardá-lo indefinidamente
+        response.set_etag(qr_render.qr_etag(payload, size, fmt))
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response.make_conditional(request)
+    except Exception as e:
+        return jsonify({"error": f"Erro ao gerar QR Code: {e}"}), 500
+
+# ===================================================================
+# ROTAS DA API - SISTEMA
+# ===================================================================
+@app.route('/api/system/stats', methods=['GET'])
+@check_token
+def get_system_stats():
+    if g.user.get('role') != 'admin':
+        return jsonify({"error": "Acesso não autorizado."}), 403
+    with _qr_cache_lock:
+        qr_cache_size = len(_qr_cache)
+    with _pending_scans_lock:
+        pending_scans = sum(_pending_scans.values())
+    return jsonify({
+        'tokenCache': token_cache_metrics(),
+        'qrCache': {'size': qr_cache_size, 'maxSize': QR_CACHE_SIZE, 'ttlSeconds': QR_CACHE_TTL},
+        'pendingQrScans': pending_scans,
+        'pendingScanAnalytics': len(_scan_events),
+        'unsavedScanBuckets': len(_unsaved_scan_buckets)
+    }), 200
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return "Acesso não autorizado.", 401
+    # Com METRICS_DIR (Gunicorn) as séries são a soma de todos os workers e do renderizador de PDFs
+    return Response(metrics.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# ===================================================================
+# COMANDOS DE MANUTENÇÃO (flask --app app <comando>)
+# ===================================================================
+@app.cli.command('rebuild-event-stats')
+@click.argument('event_ids', nargs=-1)
+def rebuild_event_stats_command(event_ids):
+    """Recalcula eventStats a partir dos convites (todos os eventos se nenhum ID for indicado)."""
+    if not event_ids:
+        event_ids = [doc.id for doc in db.collection('events').select([]).stream()]
+    for event_id in event_ids:
+        stats = rebuild_event_stats(event_id)
+        click.echo(f"{event_id}: {stats['sold']} vendidos, {stats['checkedIn']} check-ins, R$ {stats['revenue']:.2f}")
+
+@app.cli.command('rebuild-leads')
+def rebuild_leads_command():
+    """Deduplica os leads antigos por email e recalcula leadStats."""
+    merged, totals = rebuild_leads()
+    click.echo(f"{merged} envios antigos agrupados por email.")
+    for stats in sorted(totals.values(), key=lambda stats: -stats['leadCount']):
+        click.echo(f"{stats['sourceQrId']}: {stats['leadCount']} leads, {stats['submissionCount']} envios")
+
+@app.cli.command('sync-users')
+def sync_users_command():
+    """Copia todos os utilizadores do Firebase Auth para a coleção 'users' (espelho)."""
+    count = 0
+    for user in auth.list_users().iterate_all():
+        entry = user_directory_entry(user)
+        db.collection('users').document(user.uid).set(dict(entry, updatedAt=firestore.SERVER_TIMESTAMP))
+        count += 1
+    invalidate_user_directory()
+    click.echo(f"{count} utilizadores sincronizados.")
+
+@app.cli.command('render-pdfs')
+def render_pdfs_command():
+    """Renderizador de PDFs único da máquina: consome a fila em disco dos workers (PDF_RENDER_QUEUE=1)."""
+    click.echo(f"A renderizar PDFs com {ticket_pdf.PDF_RENDER_WORKERS} processos a partir de {ticket_pdf.PDF_CACHE_DIR}.")
+    ticket_pdf.run_render_server()
+
 # ===================================================================
 # ROTAS PARA SERVIR O FRONTEND
 # ===================================================================
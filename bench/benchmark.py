@@ -0,0 +1,142 @@
+# ===================================================================
+# SUITE DE BENCHMARKS (Firestore Emulator, autenticação simulada)
+# Serve a app num servidor WSGI com threads dentro deste processo, com a
+# verificação de tokens substituída por um administrador fictício, cria um
+# evento sintético e mede latência (p50/p95/p99) e débito das rotas principais
+# sob carga concorrente. O resultado vai para um ficheiro JSON, para comparar
+# execuções antes/depois de uma alteração.
+#
+# Uso:
+#   firebase emulators:start --only firestore
+#   export FIRESTORE_EMULATOR_HOST=localhost:8080
+#   python bench/benchmark.py --tickets 2000 --requests 300 --concurrency 16 --output bench-antes.json
+#   python bench/benchmark.py --tickets 2000 --requests 300 --concurrency 16 --output bench-depois.json \
+#       --baseline bench-antes.json
+# ===================================================================
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+if not os.environ.get('FIRESTORE_EMULATOR_HOST'):
+    sys.exit("Defina FIRESTORE_EMULATOR_HOST para correr contra o Firestore Emulator.")
+
+# Cache de PDFs vazio em cada execução: o cenário 'pdf' mede renderizações a frio
+os.environ.setdefault('PDF_CACHE_DIR', tempfile.mkdtemp(prefix='scansys-bench-pdf-'))
+
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+import app as scansys
+from common import DEFAULT_TICKET_TYPES, seed, run_scenario, print_result
+
+SCENARIOS = ['scan', 'redirect', 'list', 'csv', 'pdf', 'create']
+
+def fake_verify(token):
+    return {'uid': 'bench', 'name': 'Benchmark', 'email': 'bench@example.com', 'role': 'admin'}
+
+class QuietRequestHandler(WSGIRequestHandler):
+    # Sem uma linha de log por pedido, que distorceria as medições
+    def log_request(self, *args, **kwargs):
+        pass
+
+def start_server():
+    server = make_server('127.0.0.1', 0, scansys.app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def build_scenarios(base, event_id, ticket_ids, short_id, page_size):
+    headers = {'Authorization': 'Bearer bench'}
+    ticket = lambda i: ticket_ids[i % len(ticket_ids)]
+    return {
+        'scan': lambda session, i: session.post(f"{base}/api/event/ticket/scan", json={'ticketId': ticket(i)}, headers=headers),
+        'redirect': lambda session, i: session.get(f"{base}/r/{short_id}", allow_redirects=False),
+        'list': lambda session, i: session.get(f"{base}/api/events/{event_id}/tickets?limit={page_size}", headers=headers),
+        'csv': lambda session, i: session.get(f"{base}/api/events/{event_id}/tickets/export", headers=headers),
+        'pdf': lambda session, i: session.get(f"{base}/api/event/ticket/{ticket(i)}/pdf", headers=headers),
+        'create': lambda session, i: session.post(f"{base}/api/event/ticket/create", headers=headers, json={
+            'eventId': event_id, 'eventName': 'Benchmark', 'buyerName': f'Novo {i}', 'ticketType': 'Pista',
+            'pricePaid': 50.0, 'paymentMethod': 'Pix'
+        }),
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {result['scenario']: result for result in json.load(f)['results']}
+    print(f"\nComparação com {baseline_path}:")
+    for result in results:
+        before = baseline.get(result['scenario'])
+        if not before:
+            continue
+        def change(key):
+            return (result[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+        print(f"  {result['scenario']:>8}: p95 {before['p95Ms']} -> {result['p95Ms']} ms ({change('p95Ms'):+.0f}%)  "
+              f"débito {before['throughputRps']} -> {result['throughputRps']} req/s ({change('throughputRps'):+.0f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks das rotas principais do ScanSys contra o Firestore Emulator.")
+    parser.add_argument('--tickets', type=int, default=1000, help="Convites sintéticos criados no evento de teste.")
+    parser.add_argument('--ticket-types', type=int, default=len(DEFAULT_TICKET_TYPES), help="Tipos de convite do evento sintético.")
+    parser.add_argument('--requests', type=int, default=200, help="Pedidos por cenário.")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"Lista separada por vírgulas ({', '.join(SCENARIOS)}).")
+    parser.add_argument('--pdf-requests', type=int, help="Pedidos no cenário 'pdf' (por omissão, os mesmos de --requests).")
+    parser.add_argument('--page-size', type=int, default=200, help="Tamanho de página no cenário 'list'.")
+    parser.add_argument('--label', default='')
+    parser.add_argument('--output', default='bench-results.json', help="Ficheiro JSON com os resultados.")
+    parser.add_argument('--baseline', help="Resultados JSON de uma execução anterior para comparar.")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Cenários desconhecidos: {', '.join(sorted(unknown))}")
+
+    scansys.verify_token_cached = fake_verify
+    ticket_types = [dict(DEFAULT_TICKET_TYPES[i % len(DEFAULT_TICKET_TYPES)], name=f"Tipo {i + 1}") for i in range(args.ticket_types)]
+    seed_started = time.perf_counter()
+    event_id, ticket_ids, short_id = seed(scansys, args.tickets, ticket_types, label='Benchmark')
+    print(f"Evento {event_id}: {len(ticket_ids)} convites criados em {time.perf_counter() - seed_started:.1f} s")
+
+    server, base = start_server()
+    scenarios = build_scenarios(base, event_id, ticket_ids, short_id, args.page_size)
+    # O scan altera o estado dos convites: corre depois das leituras, seja qual for a ordem pedida
+    names.sort(key=lambda name: name == 'scan')
+    results = []
+    try:
+        for name in names:
+            total = args.pdf_requests if name == 'pdf' and args.pdf_requests else args.requests
+            result = run_scenario(name, scenarios[name], total, args.concurrency)
+            result['label'] = args.label
+            print_result(result, args.label)
+            results.append(result)
+    finally:
+        server.shutdown()
+
+    report = {
+        'label': args.label, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'gitRevision': git_revision(),
+        'python': platform.python_version(),
+        'config': {'tickets': args.tickets, 'ticketTypes': args.ticket_types, 'requests': args.requests,
+                   'concurrency': args.concurrency, 'pageSize': args.page_size, 'eventId': event_id},
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados gravados em {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+if __name__ == '__main__':
+    main()
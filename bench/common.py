@@ -0,0 +1,88 @@
+# ===================================================================
+# UTILITÁRIOS PARTILHADOS PELOS BENCHMARKS
+# Dados sintéticos no Firestore Emulator e execução de cenários HTTP
+# concorrentes com percentis de latência.
+# ===================================================================
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+DEFAULT_TICKET_TYPES = [
+    {'name': 'Pista', 'price': 50.0, 'active': True},
+    {'name': 'VIP', 'price': 120.0, 'active': True},
+    {'name': 'Camarote', 'price': 250.0, 'active': True},
+]
+
+def seed(scansys, ticket_count, ticket_types=None, label='Load Test'):
+    # Cria um evento com 'ticket_count' convites e um QR de redirecionamento; devolve os IDs
+    ticket_types = ticket_types or DEFAULT_TICKET_TYPES
+    event_id = f"LOADTEST_{scansys.generate_short_id(4)}"
+    scansys.db.collection('events').document(event_id).set({
+        'eventId': event_id, 'eventName': label, 'eventLocation': 'Emulador', 'eventDate': '2030-01-01',
+        'eventTime': '22:00', 'ticketTypes': ticket_types, 'combos': []
+    })
+    ticket_ids = []
+    refs = [scansys.db.collection('eventTickets').document() for _ in range(ticket_count)]
+    for start in range(0, ticket_count, scansys.FIRESTORE_BATCH_LIMIT):
+        batch = scansys.db.batch()
+        for ref in refs[start:start + scansys.FIRESTORE_BATCH_LIMIT]:
+            ticket_type = random.choice(ticket_types)
+            batch.set(ref, scansys.build_ticket_data(ref.id, {
+                'eventId': event_id, 'eventName': label, 'buyerName': f'Convidado {ref.id[:6]}',
+                'ticketType': ticket_type['name'], 'pricePaid': ticket_type['price'], 'paymentMethod': 'Pix'
+            }, 'loadtest'))
+            ticket_ids.append(ref.id)
+        batch.commit()
+    short_id = scansys.generate_short_id()
+    scansys.db.collection('marketingQRs').document(short_id).set({
+        'shortId': short_id, 'title': label, 'type': 'redirect', 'destinationUrl': 'https://example.com',
+        'scanCount': 0, 'leadCapture': {'enabled': False}
+    })
+    return event_id, ticket_ids, short_id
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def run_scenario(name, make_request, total, concurrency):
+    local = threading.local()
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def one(i):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = make_request(local.session, i)
+            # Lê o corpo inteiro: nas rotas em streaming (CSV, ZIP) é aí que está o trabalho
+            response.content
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'scenario': name, 'requests': total, 'concurrency': concurrency, 'errors': errors[0],
+        'throughputRps': round(total / wall, 1), 'p50Ms': round(percentile(latencies, 0.50), 1),
+        'p95Ms': round(percentile(latencies, 0.95), 1), 'p99Ms': round(percentile(latencies, 0.99), 1)
+    }
+
+def print_result(result, label=''):
+    print(f"[{label or '-'}] {result['scenario']:>8}: {result['throughputRps']:>7} req/s  p50 {result['p50Ms']} ms  "
+          f"p95 {result['p95Ms']} ms  p99 {result['p99Ms']} ms  erros {result['errors']}")
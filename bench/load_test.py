@@ -0,0 +1,112 @@
+# ===================================================================
+# TESTE DE CARGA (Firestore + Auth Emulator)
+# Mede o débito e a latência das rotas quentes (scan, redirect, criação de
+# convites) num servidor Gunicorn em execução, para comparar modos de worker.
+#
+# Uso:
+#   firebase emulators:start --only firestore,auth
+#   export FIRESTORE_EMULATOR_HOST=localhost:8080 FIREBASE_AUTH_EMULATOR_HOST=localhost:9099
+#   WEB_WORKER_CLASS=sync gunicorn app:app -c gunicorn.conf.py --bind 127.0.0.1:5000 &
+#   python bench/load_test.py --base-url http://127.0.0.1:5000 --label sync
+#   (repetir com WEB_WORKER_CLASS=gthread e comparar os resultados)
+#
+# Ou deixar o script arrancar um Gunicorn por modo (gevent requer o pacote gevent):
+#   python bench/load_test.py --worker-classes sync,gthread,gevent
+# ===================================================================
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+if not os.environ.get('FIRESTORE_EMULATOR_HOST') or not os.environ.get('FIREBASE_AUTH_EMULATOR_HOST'):
+    sys.exit("Defina FIRESTORE_EMULATOR_HOST e FIREBASE_AUTH_EMULATOR_HOST para correr contra os emuladores.")
+
+import app as scansys
+from common import seed, run_scenario, print_result
+
+BENCH_EMAIL = 'loadtest@example.com'
+BENCH_PASSWORD = 'loadtest-password'
+
+def emulator_id_token():
+    # Cria (uma vez) um administrador no Auth Emulator e obtém um ID token verdadeiro
+    try:
+        user = scansys.auth.get_user_by_email(BENCH_EMAIL)
+    except scansys.auth.UserNotFoundError:
+        user = scansys.auth.create_user(email=BENCH_EMAIL, password=BENCH_PASSWORD, display_name='Load Test')
+    scansys.auth.set_custom_user_claims(user.uid, {'role': 'admin'})
+    url = (f"http://{os.environ['FIREBASE_AUTH_EMULATOR_HOST']}/identitytoolkit.googleapis.com/v1/"
+           "accounts:signInWithPassword?key=fake-api-key")
+    response = requests.post(url, json={'email': BENCH_EMAIL, 'password': BENCH_PASSWORD, 'returnSecureToken': True})
+    response.raise_for_status()
+    return response.json()['idToken']
+
+def start_gunicorn(worker_class, port):
+    # Gunicorn com a configuração de produção, só com o modo de worker trocado
+    env = dict(os.environ, WEB_WORKER_CLASS=worker_class)
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}'],
+                               cwd=ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"O Gunicorn ({worker_class}) terminou no arranque com código {process.returncode}.")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/login", timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.5)
+    process.terminate()
+    sys.exit(f"O Gunicorn ({worker_class}) não respondeu em 30 s.")
+
+def run_scenarios(args, base, headers, label):
+    # Semeia a cada corrida: o cenário 'scan' faz o check-in dos convites
+    event_id, ticket_ids, short_id = seed(scansys, args.requests)
+    scenarios = {
+        'scan': lambda session, i: session.post(f"{base}/api/event/ticket/scan", json={'ticketId': ticket_ids[i % len(ticket_ids)]}, headers=headers),
+        'redirect': lambda session, i: session.get(f"{base}/r/{short_id}", allow_redirects=False),
+        'create': lambda session, i: session.post(f"{base}/api/event/ticket/create", headers=headers, json={
+            'eventId': event_id, 'eventName': 'Load Test', 'buyerName': f'Novo {i}', 'ticketType': 'Pista',
+            'pricePaid': 50.0, 'paymentMethod': 'Pix'
+        }),
+    }
+    for name in args.scenarios.split(','):
+        result = run_scenario(name, scenarios[name], args.requests, args.concurrency)
+        result['label'] = label
+        print_result(result, label)
+        if args.output:
+            with open(args.output, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga das rotas quentes do ScanSys.")
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--requests', type=int, default=500, help="Pedidos por cenário.")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--scenarios', default='scan,redirect,create')
+    parser.add_argument('--label', default='', help="Etiqueta do modo testado (ex.: sync, gthread).")
+    parser.add_argument('--worker-classes', help="Arranca um Gunicorn por modo (ex.: sync,gthread,gevent) em vez de usar --base-url.")
+    parser.add_argument('--port', type=int, default=5055, help="Porta do Gunicorn arrancado com --worker-classes.")
+    parser.add_argument('--output', help="Acrescenta os resultados (JSON por linha) a este ficheiro.")
+    args = parser.parse_args()
+
+    token = emulator_id_token()
+    headers = {'Authorization': f'Bearer {token}'}
+    if not args.worker_classes:
+        run_scenarios(args, args.base_url.rstrip('/'), headers, args.label)
+        return
+    for worker_class in args.worker_classes.split(','):
+        process = start_gunicorn(worker_class, args.port)
+        try:
+            run_scenarios(args, f"http://127.0.0.1:{args.port}", headers, worker_class)
+        finally:
+            process.terminate()
+            process.wait()
+
+if __name__ == '__main__':
+    main()
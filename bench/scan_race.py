@@ -0,0 +1,71 @@
+# ===================================================================
+# TESTE DE CONCORRÊNCIA DO CHECK-IN (Firestore Emulator)
+# Dispara N validações em paralelo contra o mesmo convite e verifica que
+# exatamente uma devolve "Entrada Liberada" e as restantes "Já Utilizado".
+#
+# Uso:
+#   firebase emulators:start --only firestore
+#   FIRESTORE_EMULATOR_HOST=localhost:8080 python bench/scan_race.py --scans 20
+# ===================================================================
+import argparse
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+if not os.environ.get('FIRESTORE_EMULATOR_HOST'):
+    sys.exit("Defina FIRESTORE_EMULATOR_HOST para correr contra o Firestore Emulator.")
+
+import app as scansys
+
+FAKE_USERS = {}
+
+def fake_verify(token):
+    # Cada token de teste corresponde a uma porta/validador diferente
+    return FAKE_USERS.setdefault(token, {'uid': token, 'name': token, 'email': f'{token}@example.com', 'role': 'admin'})
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de corrida no check-in de convites.")
+    parser.add_argument('--scans', type=int, default=20, help="Número de validações simultâneas.")
+    parser.add_argument('--rounds', type=int, default=5, help="Número de convites testados.")
+    args = parser.parse_args()
+
+    scansys.verify_token_cached = fake_verify
+    failures = 0
+    for round_number in range(args.rounds):
+        doc_ref = scansys.db.collection('eventTickets').document()
+        doc_ref.set({
+            'ticketId': doc_ref.id, 'eventId': 'RACE_TEST', 'eventName': 'Race Test', 'buyerName': f'Convidado {round_number}',
+            'ticketType': 'Pista', 'pricePaid': 0, 'paymentMethod': 'Cortesia', 'status': 'VALIDO',
+            'checkInTimestamp': None, 'scannedBy': None, 'isDeleted': False
+        })
+
+        barrier = threading.Barrier(args.scans)
+        statuses = []
+        lock = threading.Lock()
+
+        def scan(gate):
+            client = scansys.app.test_client()
+            barrier.wait()
+            response = client.post('/api/event/ticket/scan', json={'ticketId': doc_ref.id},
+                                   headers={'Authorization': f'Bearer porta{gate}'})
+            with lock:
+                statuses.append(response.get_json().get('status'))
+
+        threads = [threading.Thread(target=scan, args=(gate,)) for gate in range(args.scans)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+
+        successes = statuses.count('success')
+        warnings = statuses.count('warning')
+        ok = successes == 1 and warnings == args.scans - 1
+        failures += 0 if ok else 1
+        print(f"Convite {doc_ref.id}: {successes} sucesso(s), {warnings} aviso(s) -> {'OK' if ok else 'FALHOU'}")
+
+    if failures:
+        sys.exit(f"{failures} de {args.rounds} convites tiveram check-in duplicado.")
+    print("Todos os convites tiveram exatamente um check-in.")
+
+if __name__ == '__main__':
+    main()
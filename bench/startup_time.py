@@ -0,0 +1,70 @@
+# ===================================================================
+# TEMPO DE ARRANQUE
+# Mede, num processo Python novo (como um worker acabado de criar após um
+# cold start), quanto custa importar a app e quanto demora o primeiro pedido
+# de cada tipo comparado com o segundo.
+#
+# Uso:
+#   python bench/startup_time.py --runs 5
+#   (com Firestore: firebase emulators:start --only firestore
+#    FIRESTORE_EMULATOR_HOST=localhost:8080 python bench/startup_time.py --runs 5)
+#   python bench/startup_time.py --warm-up   # chama app.warm_up() antes dos pedidos
+# ===================================================================
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Executado num interpretador novo em cada corrida, para medir o arranque a frio
+CHILD = r'''
+import json, os, sys, time
+sys.path.insert(0, os.getcwd())
+result = {}
+started = time.perf_counter()
+import app as scansys
+result['importMs'] = (time.perf_counter() - started) * 1000
+result['heavyModulesLoaded'] = sorted(m for m in ('firebase_admin', 'google.cloud.firestore', 'weasyprint', 'qrcode') if m in sys.modules)
+if os.environ.get('STARTUP_WARM_UP') == '1':
+    result['warmUpMs'] = scansys.warm_up(pdf=os.environ.get('STARTUP_WARM_UP_PDF') == '1') * 1000
+client = scansys.app.test_client()
+routes = {'qr': '/api/qr/startup-bench.svg'}
+if os.environ.get('FIRESTORE_EMULATOR_HOST'):
+    routes['redirect'] = '/r/STARTUPBENCH'
+for name, path in routes.items():
+    for attempt in ('first', 'second'):
+        started = time.perf_counter()
+        client.get(path)
+        result[f'{name}{attempt.capitalize()}Ms'] = (time.perf_counter() - started) * 1000
+print(json.dumps(result))
+'''
+
+def run_once(warm_up, warm_up_pdf):
+    env = dict(os.environ, STARTUP_WARM_UP='1' if warm_up else '0', STARTUP_WARM_UP_PDF='1' if warm_up_pdf else '0')
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo de importação e do primeiro pedido do ScanSys.")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--warm-up', action='store_true', help="Chama app.warm_up() logo após a importação.")
+    parser.add_argument('--warm-up-pdf', action='store_true', help="Inclui o arranque do pool de PDFs no aquecimento.")
+    parser.add_argument('--output', help="Acrescenta o resumo (JSON por linha) a este ficheiro.")
+    args = parser.parse_args()
+
+    runs = [run_once(args.warm_up, args.warm_up_pdf) for _ in range(args.runs)]
+    summary = {'runs': args.runs, 'warmUp': args.warm_up, 'heavyModulesLoaded': runs[-1]['heavyModulesLoaded']}
+    for key in runs[0]:
+        if key.endswith('Ms'):
+            summary[key] = round(statistics.median(run[key] for run in runs), 1)
+            print(f"{key:>16}: {summary[key]} ms (mediana de {args.runs})")
+    print(f"Módulos pesados carregados na importação: {', '.join(summary['heavyModulesLoaded']) or 'nenhum'}")
+    if args.output:
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(summary) + '\n')
+
+if __name__ == '__main__':
+    main()
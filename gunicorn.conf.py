@@ -0,0 +1,118 @@
+# ===================================================================
+# CONFIGURAÇÃO DO GUNICORN
+# Quase todo o tempo de cada pedido é espera por Firestore, Firebase Auth ou
+# WeasyPrint; com workers 'sync' o serviço fica limitado a um pedido por worker.
+# Por omissão usamos 'gthread': várias threads por worker, compatível com o
+# cliente gRPC do Firestore sem monkey-patching.
+# ===================================================================
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 4))
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('WEB_THREADS', 8))
+worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS', 200))
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+keepalive = 5
+
+# Métricas somadas entre workers: cada processo grava o seu retrato neste diretório e o
+# /metrics junta-os todos (ver metrics.py). Definido aqui, no master, para os workers e o
+# renderizador de PDFs o herdarem; as séries dos workers que terminam passam para o archive.
+# METRICS_DIR (por omissão o diretório temporário) é só a base: o master trabalha num
+# subdiretório seu, scansys-metrics-<pid>, e nunca apaga mais nada.
+METRICS_SUBDIR = f"scansys-metrics-{os.getpid()}"
+if os.path.basename(os.environ.get('METRICS_DIR', '')) != METRICS_SUBDIR:  # Num reload (HUP) já está definido
+    os.environ['METRICS_DIR'] = os.path.join(os.environ.get('METRICS_DIR') or tempfile.gettempdir(), METRICS_SUBDIR)
+METRICS_DIR = os.environ['METRICS_DIR']
+
+def _clear_metrics_dir(remove_dir=False):
+    # Só os retratos e o archive (e os .tmp de uma escrita interrompida)
+    try:
+        names = os.listdir(METRICS_DIR)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.endswith('.json') or (name.endswith('.tmp') and '.json.' in name):
+            try:
+                os.remove(os.path.join(METRICS_DIR, name))
+            except FileNotFoundError:
+                pass
+    if remove_dir:
+        try:
+            os.rmdir(METRICS_DIR)
+        except OSError:
+            pass  # Não está vazio: ficheiros que não são nossos ficam onde estão
+
+def on_starting(server):
+    # Um arranque novo começa do zero, como os contadores em memória
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _clear_metrics_dir()
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(worker.pid)
+
+# Aquecimento de cada worker depois do fork (Firebase, canal gRPC, qrcode; PDFs com WARM_UP_PDF=1).
+# Corre numa thread para o worker começar logo a aceitar pedidos; WARM_UP=0 desliga.
+WARM_UP = os.environ.get('WARM_UP', '1') == '1'
+WARM_UP_PDF = os.environ.get('WARM_UP_PDF', '0') == '1'
+
+def post_worker_init(worker):
+    # Com 'gevent' (opcional, requer o pacote gevent) o gRPC tem de usar o ciclo do gevent.
+    # O worker gevent só aplica o monkey.patch_all() depois do post_fork, por isso é feito aqui,
+    # antes do aquecimento abrir o primeiro canal do Firestore.
+    if worker_class == 'gevent':
+        from grpc.experimental import gevent as grpc_gevent
+        grpc_gevent.init_gevent()
+    if not WARM_UP:
+        return
+
+    def run():
+        from app import warm_up as warm_up_app
+        try:
+            elapsed = warm_up_app(pdf=WARM_UP_PDF)
+            worker.log.info("Worker %s aquecido em %.0f ms", worker.pid, elapsed * 1000)
+        except Exception:
+            worker.log.exception("Falha no aquecimento do worker %s", worker.pid)
+
+    threading.Thread(target=run, daemon=True).start()
+
+# Renderizador de PDFs único da máquina: o master arranca 'flask render-pdfs' (e volta a
+# arrancá-lo se morrer) e os workers, com PDF_RENDER_QUEUE=1, enviam-lhe as renderizações
+# pela fila em disco em vez de cada um ter o seu pool. PDF_RENDERER=0 volta ao pool por worker.
+PDF_RENDERER = os.environ.get('PDF_RENDERER', '1') == '1'
+if PDF_RENDERER:
+    os.environ['PDF_RENDER_QUEUE'] = '1'  # Herdado pelos workers criados a seguir
+
+_renderer = None
+_renderer_stopping = threading.Event()
+
+def when_ready(server):
+    if not PDF_RENDERER:
+        return
+
+    def supervise():
+        global _renderer
+        env = dict(os.environ, PDF_RENDER_QUEUE='0')
+        while not _renderer_stopping.is_set():
+            _renderer = subprocess.Popen([sys.executable, '-m', 'flask', '--app', 'app', 'render-pdfs'], env=env)
+            code = _renderer.wait()
+            import metrics
+            metrics.mark_process_dead(_renderer.pid)
+            if _renderer_stopping.is_set():
+                break
+            server.log.warning("Renderizador de PDFs terminou com código %s; a reiniciar", code)
+            time.sleep(5)
+
+    threading.Thread(target=supervise, daemon=True).start()
+
+def on_exit(server):
+    _renderer_stopping.set()
+    if _renderer is not None:
+        _renderer.terminate()
+    _clear_metrics_dir(remove_dir=True)
@@ -0,0 +1,440 @@
+# ===================================================================
+# MÉTRICAS (formato de exposição do Prometheus)
+# Histogramas e contadores em memória, por processo, mais a contabilidade de
+# cada pedido: quantas chamadas ao Firestore e ao Firebase Auth fez, quanto
+# tempo demoraram e quantos documentos leu e escreveu.
+# Com METRICS_DIR (definido pelo gunicorn.conf.py) cada processo grava ali um
+# retrato das suas séries e o /metrics soma os de todos os workers e do
+# renderizador de PDFs, seja qual for o worker que recebe o scrape.
+# Independente do Flask, para poder ser usado também pelo ticket_pdf.
+# ===================================================================
+import atexit
+import inspect
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CALL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+METRICS_DIR = os.environ.get('METRICS_DIR')
+# Intervalo (segundos) entre gravações do retrato de cada processo em METRICS_DIR.
+METRICS_WRITE_INTERVAL = float(os.environ.get('METRICS_WRITE_INTERVAL', 5))
+
+_registry = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        _ensure_snapshot_writer()
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(values, key, value):
+        values[key] = values.get(key, 0) + value
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        if values is None:
+            values = {tuple(key): value for key, value in self.snapshot()}
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        _ensure_snapshot_writer()
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, upper in enumerate(self.buckets):
+                if value <= upper:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), [list(bucket_counts), total, count]] for key, (bucket_counts, total, count) in self._values.items()]
+
+    @staticmethod
+    def merge(values, key, value):
+        series = values.get(key)
+        if series is None:
+            values[key] = [list(value[0]), value[1], value[2]]
+            return
+        series[0] = [a + b for a, b in zip(series[0], value[0])]
+        series[1] += value[1]
+        series[2] += value[2]
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        if values is None:
+            values = {tuple(key): value for key, value in self.snapshot()}
+        for key, (bucket_counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for upper, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_number(upper))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+def render_metrics():
+    lines = []
+    if METRICS_DIR:
+        merged = _merge_snapshots()
+        for metric in _registry:
+            lines.extend(metric.render(merged.get(metric.name, {})))
+    else:
+        for metric in _registry:
+            lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# --- Agregação entre processos (METRICS_DIR) ---
+# Cada processo grava <pid>-<arranque>.json (escrita atómica) a cada METRICS_WRITE_INTERVAL,
+# ao sair e antes de responder a um scrape. Quando um worker termina, o master do Gunicorn
+# junta o seu último retrato ao archive.json (mark_process_dead), para os contadores nunca
+# descerem; o archive guarda também os nomes dos ficheiros já incluídos.
+METRICS_ARCHIVE = 'archive.json'
+
+_snapshot_lock = threading.Lock()
+_snapshot_pid = None
+_snapshot_name = None
+
+def _ensure_snapshot_writer():
+    # Arranca a thread de gravação no primeiro registo de cada processo (depois do fork)
+    global _snapshot_pid, _snapshot_name
+    if not METRICS_DIR or _snapshot_pid == os.getpid():
+        return
+    with _snapshot_lock:
+        if _snapshot_pid == os.getpid():
+            return
+        _snapshot_pid = os.getpid()
+        _snapshot_name = f"{_snapshot_pid}-{time.time_ns()}.json"
+        threading.Thread(target=_snapshot_loop, daemon=True).start()
+
+def _snapshot_loop():
+    while True:
+        time.sleep(METRICS_WRITE_INTERVAL)
+        try:
+            write_snapshot()
+        except OSError:
+            pass
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def write_snapshot():
+    if not METRICS_DIR or _snapshot_pid != os.getpid():
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    _write_json(os.path.join(METRICS_DIR, _snapshot_name), {metric.name: metric.snapshot() for metric in _registry})
+
+@atexit.register
+def _write_final_snapshot():
+    try:
+        write_snapshot()
+    except OSError:
+        pass
+
+def _merge_into(merged, snapshot):
+    metrics_by_name = {metric.name: metric for metric in _registry}
+    for name, series in snapshot.items():
+        metric = metrics_by_name.get(name)
+        if metric is None:
+            continue
+        values = merged.setdefault(name, {})
+        for key, value in series:
+            metric.merge(values, tuple(key), value)
+    return merged
+
+def _merge_snapshots():
+    write_snapshot()
+    # Lê primeiro os retratos e só depois o archive: um worker arquivado entretanto
+    # aparece num dos dois, nunca em nenhum nem nos dois
+    snapshots = {}
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith('.json') and name != METRICS_ARCHIVE:
+            snapshot = _read_json(os.path.join(METRICS_DIR, name))
+            if snapshot is not None:
+                snapshots[name] = snapshot
+    archive = _read_json(os.path.join(METRICS_DIR, METRICS_ARCHIVE)) or {'files': [], 'metrics': {}}
+    merged = _merge_into({}, archive['metrics'])
+    for name, snapshot in snapshots.items():
+        if name not in archive['files']:
+            _merge_into(merged, snapshot)
+    return merged
+
+def mark_process_dead(pid):
+    # Chamado pelo master do Gunicorn (child_exit) e pelo supervisor do renderizador de PDFs
+    if not METRICS_DIR:
+        return
+    try:
+        names = [name for name in os.listdir(METRICS_DIR) if name.startswith(f"{pid}-") and name.endswith('.json')]
+    except FileNotFoundError:
+        return
+    for name in names:
+        path = os.path.join(METRICS_DIR, name)
+        snapshot = _read_json(path)
+        archive_path = os.path.join(METRICS_DIR, METRICS_ARCHIVE)
+        archive = _read_json(archive_path) or {'files': [], 'metrics': {}}
+        if snapshot is not None and name not in archive['files']:
+            merged = _merge_into(_merge_into({}, archive['metrics']), snapshot)
+            archive = {'files': archive['files'] + [name], 'metrics': _as_series(merged)}
+            _write_json(archive_path, archive)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def _as_series(values_by_metric):
+    return {name: [[list(key), value] for key, value in values.items()] for name, values in values_by_metric.items()}
+
+# --- Métricas da aplicação ---
+http_request_duration = Histogram(
+    'scansys_http_request_duration_seconds', "Duração dos pedidos HTTP por rota.", ['method', 'route', 'status'])
+backend_call_duration = Histogram(
+    'scansys_backend_call_duration_seconds', "Duração das chamadas ao Firestore, ao Firebase Auth e das esperas por PDFs.",
+    ['service', 'operation'])
+backend_calls_per_request = Histogram(
+    'scansys_backend_calls_per_request', "Chamadas ao Firestore/Auth feitas por cada pedido.", ['route', 'service'],
+    buckets=CALL_COUNT_BUCKETS)
+firestore_documents = Counter(
+    'scansys_firestore_documents_total', "Documentos lidos e escritos no Firestore, por rota.", ['route', 'kind'])
+pdf_render_duration = Histogram(
+    'scansys_pdf_render_seconds', "Tempo de renderização do WeasyPrint por convite.", ['priority'])
+pdf_queue_wait = Histogram(
+    'scansys_pdf_queue_wait_seconds', "Tempo de espera na fila de renderização de PDFs.", ['priority'])
+
+# --- Contabilidade por pedido ---
+class RequestStats:
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.calls = {}
+        self.documents = {'read': 0, 'write': 0}
+        self.finished = False
+
+    def add_call(self, service, operation, seconds):
+        entry = self.calls.setdefault((service, operation), [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def breakdown(self):
+        parts = [f"{service}.{operation} x{count} {seconds * 1000:.0f}ms"
+                 for (service, operation), (count, seconds) in sorted(self.calls.items(), key=lambda item: -item[1][1])]
+        parts.append(f"docs lidos {self.documents['read']}, escritos {self.documents['write']}")
+        return ', '.join(parts)
+
+_current_request = ContextVar('scansys_request_stats', default=None)
+
+def begin_request(route):
+    stats = RequestStats(route)
+    _current_request.set(stats)
+    return stats
+
+def current_request():
+    return _current_request.get()
+
+def finish_request(stats, method, status):
+    # Idempotente: as respostas em streaming terminam depois do teardown do pedido
+    if stats.finished:
+        return None
+    stats.finished = True
+    elapsed = time.perf_counter() - stats.started
+    http_request_duration.observe(elapsed, method=method, route=stats.route, status=status)
+    per_service = {'firestore': 0, 'auth': 0}
+    for (service, _), (count, _) in stats.calls.items():
+        per_service[service] = per_service.get(service, 0) + count
+    for service, count in per_service.items():
+        backend_calls_per_request.observe(count, route=stats.route, service=service)
+    for kind, count in stats.documents.items():
+        if count:
+            firestore_documents.inc(count, route=stats.route, kind=kind)
+    if _current_request.get() is stats:
+        _current_request.set(None)
+    return elapsed
+
+def record_call(service, operation, seconds, documents_read=0, documents_written=0):
+    backend_call_duration.observe(seconds, service=service, operation=operation)
+    stats = _current_request.get()
+    if stats is not None:
+        stats.add_call(service, operation, seconds)
+        stats.documents['read'] += documents_read
+        stats.documents['write'] += documents_written
+    elif documents_read or documents_written:
+        # Trabalho em segundo plano (flush das leituras de QR, pré-renderização...)
+        firestore_documents.inc(documents_read, route='background', kind='read')
+        firestore_documents.inc(documents_written, route='background', kind='write')
+
+# --- Firebase Auth ---
+class TimedModule:
+    # Envolve as funções de um módulo (ex.: firebase_admin.auth) para medir cada chamada;
+    # classes e exceções (auth.UserNotFoundError...) passam intactas
+    def __init__(self, module, service):
+        self._module = module
+        self._service = service
+
+    def __getattr__(self, name):
+        attribute = getattr(self._module, name)
+        if not inspect.isfunction(attribute):
+            return attribute
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return attribute(*args, **kwargs)
+            finally:
+                record_call(self._service, name, time.perf_counter() - started)
+        return timed
+
+# --- Firestore ---
+# Instrumenta o cliente gRPC gerado (FirestoreClient), por onde passam todas as operações
+# de alto nível: get(), stream(), get_all(), commit() dos batches, etc.
+FIRESTORE_UNARY_OPERATIONS = ['get_document', 'list_documents', 'update_document', 'delete_document', 'create_document',
+                              'begin_transaction', 'commit', 'rollback', 'batch_write', 'list_collection_ids', 'partition_query']
+FIRESTORE_STREAMING_OPERATIONS = ['batch_get_documents', 'run_query', 'run_aggregation_query']
+
+_firestore_instrumented = False
+_firestore_lock = threading.Lock()
+
+def _written_documents(kwargs):
+    request = kwargs.get('request')
+    writes = request.get('writes') if isinstance(request, dict) else getattr(request, 'writes', None)
+    return len(writes or [])
+
+def _read_documents(operation, response):
+    try:
+        if operation == 'run_query':
+            return 1 if 'document' in response else 0
+        if operation == 'batch_get_documents':
+            return 1 if 'found' in response else 0
+    except TypeError:
+        pass
+    return 1 if operation == 'run_aggregation_query' else 0
+
+class _TimedStream:
+    # O tempo de uma consulta em streaming é gasto a iterar a resposta, não a chamá-la
+    def __init__(self, stream, operation, elapsed):
+        self._raw = stream
+        self._stream = iter(stream)
+        self._operation = operation
+        self._elapsed = elapsed
+        self._documents = 0
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            response = next(self._stream)
+        except Exception:
+            # Inclui o StopIteration do fim normal da resposta
+            self._elapsed += time.perf_counter() - started
+            self._finish()
+            raise
+        self._elapsed += time.perf_counter() - started
+        self._documents += _read_documents(self._operation, response)
+        return response
+
+    def _finish(self):
+        if not self._done:
+            self._done = True
+            record_call('firestore', self._operation, self._elapsed, documents_read=self._documents)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __del__(self):
+        # Iteração interrompida a meio (ex.: limit atingido do lado do cliente)
+        self._finish()
+
+def _timed_unary(method, operation):
+    def timed(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            reads = 1 if operation == 'get_document' else 0
+            writes = _written_documents(kwargs) if operation in ('commit', 'batch_write') else 0
+            record_call('firestore', operation, time.perf_counter() - started, documents_read=reads, documents_written=writes)
+    return timed
+
+def _timed_streaming(method, operation):
+    def timed(self, *args, **kwargs):
+        started = time.perf_counter()
+        stream = method(self, *args, **kwargs)
+        return _TimedStream(stream, operation, time.perf_counter() - started)
+    return timed
+
+def instrument_firestore():
+    global _firestore_instrumented
+    with _firestore_lock:
+        if _firestore_instrumented:
+            return
+        from google.cloud.firestore_v1.services.firestore.client import FirestoreClient
+        for operation in FIRESTORE_UNARY_OPERATIONS:
+            setattr(FirestoreClient, operation, _timed_unary(getattr(FirestoreClient, operation), operation))
+        for operation in FIRESTORE_STREAMING_OPERATIONS:
+            setattr(FirestoreClient, operation, _timed_streaming(getattr(FirestoreClient, operation), operation))
+        _firestore_instrumented = True
+
+# --- Renderização de PDFs ---
+# A renderização corre noutro processo; o tempo que o pedido passa à espera do PDF
+# entra na contabilidade do pedido como serviço 'pdf' (ver ticket_pdf.get_or_render_pdf).
+def record_pdf_render(priority, render_seconds, queue_seconds):
+    pdf_queue_wait.observe(queue_seconds, priority=priority)
+    if render_seconds is not None:
+        pdf_render_duration.observe(render_seconds, priority=priority)
@@ -0,0 +1,67 @@
+# ===================================================================
+# RENDERIZAÇÃO DE QR CODES (SVG e PNG)
+# Partilhado pelos PDFs dos convites e pela rota /api/qr/<payload>.<formato>.
+# O resultado é determinístico, por isso fica em cache (LRU) por
+# (conteúdo, tamanho, formato) e pode ser servido com ETag forte.
+# ===================================================================
+import base64
+import hashlib
+import io
+import os
+import threading
+
+from cachetools import LRUCache
+
+# Cache limitado em bytes, não em entradas: um QR grande (conteúdo longo, size 40) tem centenas de KB
+QR_RENDER_CACHE_BYTES = int(os.environ.get('QR_RENDER_CACHE_MB', 16)) * 1024 * 1024
+# Imagens maiores que isto são devolvidas mas não guardadas
+QR_RENDER_CACHE_ITEM_BYTES = 64 * 1024
+QR_FORMATS = {'svg': 'image/svg+xml', 'png': 'image/png'}
+QR_MIN_SIZE, QR_MAX_SIZE = 1, 40
+QR_BORDER = 2
+# Conteúdo máximo (caracteres): chega para qualquer URL de convite ou de marketing
+QR_MAX_PAYLOAD = int(os.environ.get('QR_MAX_PAYLOAD', 512))
+
+_render_cache = LRUCache(maxsize=QR_RENDER_CACHE_BYTES, getsizeof=len)
+_render_cache_lock = threading.Lock()
+
+def clamp_size(size):
+    return max(QR_MIN_SIZE, min(int(size), QR_MAX_SIZE))
+
+def render_qr(payload, size=4, fmt='svg'):
+    # 'size' é o tamanho de cada módulo (box_size); o SVG é vetorial e muito mais barato que o PNG via PIL
+    if fmt not in QR_FORMATS:
+        raise ValueError(f"Formato de QR Code inválido: {fmt}")
+    if len(payload) > QR_MAX_PAYLOAD:
+        raise ValueError(f"Conteúdo do QR Code maior que {QR_MAX_PAYLOAD} caracteres.")
+    size = clamp_size(size)
+    key = (payload, size, fmt)
+    with _render_cache_lock:
+        image = _render_cache.get(key)
+    if image is None:
+        image = _render_qr(payload, size, fmt)
+        if len(image) <= QR_RENDER_CACHE_ITEM_BYTES:
+            with _render_cache_lock:
+                _render_cache[key] = image
+    return image
+
+def _render_qr(payload, size, fmt):
+    # qrcode (e o PIL, para PNG) só é carregado no primeiro QR Code gerado pelo processo
+    import qrcode
+    import qrcode.image.svg
+    image_factory = qrcode.image.svg.SvgPathImage if fmt == 'svg' else None
+    qr = qrcode.QRCode(version=1, box_size=size, border=QR_BORDER, image_factory=image_factory)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    buffered = io.BytesIO()
+    if fmt == 'svg':
+        qr.make_image().save(buffered)
+    else:
+        qr.make_image(fill='black', back_color='white').save(buffered, format="PNG")
+    return buffered.getvalue()
+
+def qr_data_uri(payload, size=4, fmt='svg'):
+    return f"data:{QR_FORMATS[fmt]};base64," + base64.b64encode(render_qr(payload, size, fmt)).decode('ascii')
+
+def qr_etag(payload, size=4, fmt='svg'):
+    return hashlib.sha256(repr((payload, clamp_size(size), fmt, QR_BORDER)).encode('utf-8')).hexdigest()[:32]
@@ -1,10 +1,8 @@
-import firebase_admin
-from firebase_admin import credentials, auth
-
-# --- Configuração do Firebase Admin ---
-# Este script assume que está na mesma pasta que o seu serviceAccountKey.json
-cred = credentials.Certificate("serviceAccountKey.json")
-firebase_admin.initialize_app(cred)
+# Promove um utilizador a administrador através de set_user_role (app.py), para que as
+# claims e o espelho 'users' fiquem coerentes. Com USERS_MIRROR=1 no servidor, corra este
+# script também com USERS_MIRROR=1 (ou corra 'flask --app app sync-users' a seguir).
+# A credencial é a mesma da aplicação: serviceAccountKey.json nesta pasta ou SERVICE_ACCOUNT_JSON.
+from app import auth, set_user_role
 
 # --- AÇÃO NECESSÁRIA ---
 # Substitua o texto abaixo pelo UID do utilizador que você copiou do Firebase
@@ -12,7 +10,7 @@ uid = "JrrTqg5gALNhw4UuOkO4EZpZUiS2"
 
 try:
     # Define a permissão (custom claim) de 'admin' para o utilizador especificado
-    auth.set_custom_user_claims(uid, {'role': 'admin'})
+    set_user_role(auth.get_user(uid), 'admin')
     
     # Verifica se a permissão foi definida corretamente
     user = auth.get_user(uid)
@@ -22,4 +20,3 @@ try:
 except Exception as e:
     print(f"Ocorreu um erro: {e}")
     print("Verifique se o UID está correto e se o ficheiro serviceAccountKey.json está na pasta.")
-
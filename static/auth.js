@@ -29,7 +29,12 @@ auth.onAuthStateChanged(user => {
             localStorage.setItem('userClaims', JSON.stringify(claims));
 
             if (isLoginPage) {
-                if (claims.role === 'admin') {
+                // ?next=/validator (ou outra página interna) volta para onde o utilizador estava
+                const next = new URLSearchParams(window.location.search).get('next');
+                // Só caminhos internos: '//host' e '/\host' levariam para outro domínio
+                if (next && /^\/(?![\/\\])/.test(next)) {
+                    window.location.href = next;
+                } else if (claims.role === 'admin') {
                     window.location.href = '/admin/events';
                 } else {
                     window.location.href = '/admin/tickets';
@@ -16,28 +16,68 @@ async function loadTicketReport(eventId) {
         });
     }
 
+    const pdfBundleBtn = document.getElementById('export-pdf-bundle-btn');
+    if (pdfBundleBtn) {
+        pdfBundleBtn.onclick = () => downloadPdfBundle(eventId, pdfBundleBtn);
+    }
+
+    const importBtn = document.getElementById('import-guests-btn');
+    const importFile = document.getElementById('import-guests-file');
+    if (importBtn && importFile) {
+        importBtn.onclick = () => importFile.click();
+        importFile.onchange = () => {
+            if (importFile.files.length) importGuestList(eventId, importFile.files[0], importBtn);
+            importFile.value = '';
+        };
+    }
+
     await loadEventDetails(eventId);
     
-    const apiUrl = `/api/events/${eventId}/tickets`;
     const tableBody = document.getElementById('report-table-body');
-    const totalTicketsSpan = document.getElementById('total-tickets');
-    const totalRevenueSpan = document.getElementById('total-revenue');
+    tableBody.innerHTML = '';
+    loadEventStats(eventId);
+    await loadTicketPage(eventId, null);
+}
+
+// Totais vêm do agregado eventStats (documento base + shards), independente do número de convites
+async function loadEventStats(eventId) {
+    const token = await window.getAuthToken();
+    try {
+        const response = await fetch(`/api/events/${eventId}/stats`, { headers: { 'Authorization': `Bearer ${token}` } });
+        if (!response.ok) throw new Error('Falha ao carregar estatísticas.');
+        const stats = await response.json();
+        document.getElementById('total-tickets').textContent = stats.sold || 0;
+        document.getElementById('total-revenue').textContent = (stats.revenue || 0).toFixed(2);
+        const checkedInSpan = document.getElementById('total-checked-in');
+        if (checkedInSpan) checkedInSpan.textContent = stats.checkedIn || 0;
+    } catch (error) {
+        console.error('Erro ao buscar estatísticas do evento:', error);
+    }
+}
+
+// A tabela é carregada por páginas; o cursor da página seguinte vem no cabeçalho X-Next-Cursor
+const REPORT_PAGE_SIZE = 200;
+const REPORT_FIELDS = 'ticketId,purchaseDate,buyerName,ticketType,paymentMethod,soldBy,status,isDeleted';
+
+async function loadTicketPage(eventId, cursor) {
+    const tableBody = document.getElementById('report-table-body');
     const token = await window.getAuthToken();
+    let apiUrl = `/api/events/${eventId}/tickets?limit=${REPORT_PAGE_SIZE}&fields=${REPORT_FIELDS}`;
+    if (cursor) apiUrl += `&startAfter=${encodeURIComponent(cursor)}`;
+
+    const loadMoreRow = document.getElementById('load-more-row');
+    if (loadMoreRow) loadMoreRow.remove();
 
     try {
         const response = await fetch(apiUrl, { headers: { 'Authorization': `Bearer ${token}` } });
         if (!response.ok) throw new Error('Falha ao carregar relatório.');
         const data = await response.json();
 
-        tableBody.innerHTML = '';
-        if (!data || data.length === 0) {
+        if (!cursor && (!data || data.length === 0)) {
             tableBody.innerHTML = '<tr><td colspan="7" style="text-align: center;">Nenhum bilhete vendido para este evento.</td></tr>';
-            totalTicketsSpan.textContent = '0';
-            totalRevenueSpan.textContent = '0.00';
             return;
         }
 
-        let totalRevenue = 0;
         data.forEach(ticket => {
             const tr = document.createElement('tr');
             const purchaseDate = ticket.purchaseDate && ticket.purchaseDate._seconds ? new Date(ticket.purchaseDate._seconds * 1000) : new Date();
@@ -69,13 +109,16 @@ async function loadTicketReport(eventId) {
                 <td style="text-align: center;">${actionsHtml}</td>
             `;
             tableBody.appendChild(tr);
-            if (ticket.status !== 'EXCLUIDO' && !ticket.isDeleted) {
-                totalRevenue += ticket.pricePaid;
-            }
         });
 
-        totalTicketsSpan.textContent = data.filter(t => t.status !== 'EXCLUIDO' && !t.isDeleted).length;
-        totalRevenueSpan.textContent = totalRevenue.toFixed(2);
+        const nextCursor = response.headers.get('X-Next-Cursor');
+        if (nextCursor) {
+            const tr = document.createElement('tr');
+            tr.id = 'load-more-row';
+            tr.innerHTML = '<td colspan="7" style="text-align: center;"><button class="action-btn">Carregar mais</button></td>';
+            tr.querySelector('button').addEventListener('click', () => loadTicketPage(eventId, nextCursor));
+            tableBody.appendChild(tr);
+        }
 
     } catch (error) {
         console.error('Erro ao buscar relatório de bilhetes:', error);
@@ -95,6 +138,60 @@ async function loadEventDetails(eventId) {
         .catch(error => console.error('Erro ao buscar detalhes do evento:', error));
 }
 
+// Lista de convidados em CSV (colunas Comprador/buyerName e Tipo Convite/ticketType): convites de cortesia
+async function importGuestList(eventId, file, button) {
+    const originalHtml = button.innerHTML;
+    button.disabled = true;
+    button.innerHTML = '<i class="fas fa-spinner fa-spin"></i> A importar...';
+    try {
+        const token = await window.getAuthToken();
+        const response = await fetch(`/api/events/${eventId}/tickets/import`, {
+            method: 'POST',
+            headers: { 'Authorization': `Bearer ${token}`, 'Content-Type': 'text/csv' },
+            body: file
+        });
+        const report = await response.json();
+        if (!report.results) throw new Error(report.error || 'Falha na importação.');
+        const errors = report.results.filter(r => !r.success).slice(0, 10).map(r => `Linha ${r.row}: ${r.error}`);
+        let message = `${report.created} convites criados, ${report.failed} linhas com erro.`;
+        if (report.error) message += `\n${report.error}`;
+        if (errors.length) message += `\n\n${errors.join('\n')}`;
+        alert(message);
+        if (report.created > 0) {
+            document.getElementById('report-table-body').innerHTML = '';
+            loadEventStats(eventId);
+            loadTicketPage(eventId, null);
+        }
+    } catch (error) {
+        alert('Erro ao importar convidados: ' + error.message);
+    } finally {
+        button.disabled = false;
+        button.innerHTML = originalHtml;
+    }
+}
+
+async function downloadPdfBundle(eventId, button) {
+    const originalHtml = button.innerHTML;
+    button.disabled = true;
+    button.innerHTML = '<i class="fas fa-spinner fa-spin"></i> A gerar PDFs...';
+    try {
+        const token = await window.getAuthToken();
+        const response = await fetch(`/api/events/${eventId}/tickets/pdf-bundle`, { headers: { 'Authorization': `Bearer ${token}` } });
+        if (!response.ok) throw new Error('Falha ao gerar os PDFs.');
+        const blob = await response.blob();
+        const link = document.createElement('a');
+        link.href = URL.createObjectURL(blob);
+        link.download = `convites_${eventId}.zip`;
+        link.click();
+        URL.revokeObjectURL(link.href);
+    } catch (error) {
+        alert('Erro ao baixar os PDFs: ' + error.message);
+    } finally {
+        button.disabled = false;
+        button.innerHTML = originalHtml;
+    }
+}
+
 async function deleteTicket(ticketId, eventId) {
     if (!confirm(`Tem a certeza de que quer excluir o bilhete ${ticketId}? Esta ação irá invalidá-lo para o check-in.`)) {
         return;
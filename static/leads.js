@@ -1,42 +1,103 @@
 // A chamada inicial é feita pelo auth.js
 document.addEventListener('DOMContentLoaded', function() {
-    // Apenas prepara a página, o carregamento é acionado pelo auth.js
+    const filterForm = document.getElementById('leads-filter-form');
+    if (filterForm) {
+        filterForm.addEventListener('submit', (event) => {
+            event.preventDefault();
+            loadLeads();
+        });
+    }
+    const exportBtn = document.getElementById('export-leads-btn');
+    if (exportBtn) {
+        exportBtn.addEventListener('click', () => downloadLeadsCsv(exportBtn));
+    }
 });
 
+const LEADS_PAGE_SIZE = 200;
+
+function leadsFilterParams() {
+    const params = new URLSearchParams();
+    const sourceInput = document.getElementById('leads-source-filter');
+    if (sourceInput && sourceInput.value.trim()) params.set('sourceQrId', sourceInput.value.trim());
+    return params;
+}
+
 async function loadLeads() {
-    const apiUrl = '/api/leads';
+    document.getElementById('leads-table-body').innerHTML = '<tr><td colspan="7">A carregar...</td></tr>';
+    await loadLeadsPage(null);
+}
+
+async function loadLeadsPage(cursor) {
     const tableBody = document.getElementById('leads-table-body');
     const token = await window.getAuthToken();
 
     if (!token) return;
 
-    fetch(apiUrl, { headers: { 'Authorization': `Bearer ${token}` } })
-        .then(response => {
-            if (response.status === 401) { window.location.href = '/'; return; }
-            return response.json();
-        })
-        .then(data => {
-            tableBody.innerHTML = '';
-            if (!data || data.length === 0) {
-                tableBody.innerHTML = '<tr><td colspan="6" style="text-align: center;">Nenhum lead capturado ainda.</td></tr>';
-                return;
-            }
-            data.forEach(lead => {
-                const tr = document.createElement('tr');
-                const date = lead.timestamp ? new Date(lead.timestamp._seconds * 1000) : new Date();
-                tr.innerHTML = `
-                    <td>${date.toLocaleString('pt-BR')}</td>
-                    <td>${lead.name}</td>
-                    <td>${lead.email}</td>
-                    <td>${lead.phone || '---'}</td>
-                    <td>${lead.city || '---'}</td>
-                    <td>${lead.sourceQrId}</td>
-                `;
-                tableBody.appendChild(tr);
-            });
-        })
-        .catch(error => {
-            console.error('Erro ao buscar leads:', error);
-            tableBody.innerHTML = '<tr><td colspan="6" style="text-align: center; color: var(--cor-erro);">Erro ao carregar os dados.</td></tr>';
+    const params = leadsFilterParams();
+    params.set('limit', LEADS_PAGE_SIZE);
+    if (cursor) params.set('startAfter', cursor);
+
+    const loadMoreRow = document.getElementById('leads-load-more-row');
+    if (loadMoreRow) loadMoreRow.remove();
+
+    try {
+        const response = await fetch(`/api/leads?${params}`, { headers: { 'Authorization': `Bearer ${token}` } });
+        if (response.status === 401) { window.location.href = '/'; return; }
+        if (!response.ok) throw new Error('Falha ao carregar leads.');
+        const data = await response.json();
+
+        if (!cursor) tableBody.innerHTML = '';
+        if (!cursor && (!data || data.length === 0)) {
+            tableBody.innerHTML = '<tr><td colspan="7" style="text-align: center;">Nenhum lead capturado ainda.</td></tr>';
+            return;
+        }
+        data.forEach(lead => {
+            const tr = document.createElement('tr');
+            const date = lead.timestamp ? new Date(lead.timestamp._seconds * 1000) : new Date();
+            tr.innerHTML = `
+                <td>${date.toLocaleString('pt-BR')}</td>
+                <td>${lead.name}</td>
+                <td>${lead.email}</td>
+                <td>${lead.phone || '---'}</td>
+                <td>${lead.city || '---'}</td>
+                <td>${(lead.sourceQrIds || [lead.sourceQrId]).join(', ')}</td>
+                <td>${lead.submissionCount || 1}</td>
+            `;
+            tableBody.appendChild(tr);
         });
+
+        const nextCursor = response.headers.get('X-Next-Cursor');
+        if (nextCursor) {
+            const tr = document.createElement('tr');
+            tr.id = 'leads-load-more-row';
+            tr.innerHTML = '<td colspan="7" style="text-align: center;"><button class="action-btn">Carregar mais</button></td>';
+            tr.querySelector('button').addEventListener('click', () => loadLeadsPage(nextCursor));
+            tableBody.appendChild(tr);
+        }
+    } catch (error) {
+        console.error('Erro ao buscar leads:', error);
+        tableBody.innerHTML = '<tr><td colspan="7" style="text-align: center; color: var(--cor-erro);">Erro ao carregar os dados.</td></tr>';
+    }
+}
+
+async function downloadLeadsCsv(button) {
+    const originalHtml = button.innerHTML;
+    button.disabled = true;
+    button.innerHTML = '<i class="fas fa-spinner fa-spin"></i> A exportar...';
+    try {
+        const token = await window.getAuthToken();
+        const response = await fetch(`/api/leads/export?${leadsFilterParams()}`, { headers: { 'Authorization': `Bearer ${token}` } });
+        if (!response.ok) throw new Error('Falha ao exportar os leads.');
+        const blob = await response.blob();
+        const link = document.createElement('a');
+        link.href = URL.createObjectURL(blob);
+        link.download = 'leads.csv';
+        link.click();
+        URL.revokeObjectURL(link.href);
+    } catch (error) {
+        alert('Erro ao exportar leads: ' + error.message);
+    } finally {
+        button.disabled = false;
+        button.innerHTML = originalHtml;
+    }
 }
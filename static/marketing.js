@@ -129,8 +129,11 @@ async function handleFormSubmit(event) {
             responseArea.style.backgroundColor = 'var(--cor-sucesso)';
             responseArea.innerHTML = `<h3>QR Code Gerado!</h3>
                 <p>O seu link é: <a href="${data.qrCodeUrl}" target="_blank">${data.qrCodeUrl}</a></p>
-                <div id="qrcode-result" style="background: white; padding: 10px; display: inline-block; margin-top: 10px;"></div>`;
-            new QRCode(document.getElementById("qrcode-result"), data.qrCodeUrl);
+                <div id="qrcode-result" style="background: white; padding: 10px; display: inline-block; margin-top: 10px;">
+                    <img src="${data.qrImageSvgUrl}" alt="QR Code" style="width: 256px; height: 256px; display: block;">
+                </div>
+                <p><a href="${data.qrImagePngUrl}" download="qrcode_${data.shortId}.png" class="action-btn">Baixar PNG</a>
+                   <a href="${data.qrImageSvgUrl}" download="qrcode_${data.shortId}.svg" class="action-btn">Baixar SVG</a></p>`;
             
             // CORREÇÃO: Obter o formulário diretamente pelo ID antes de o limpar.
             document.getElementById('marketing-form').reset();
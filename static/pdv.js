@@ -98,24 +98,25 @@ async function submitSale(event) {
     const selectedEvent = eventsData.find(event => event.eventId === selectedEventId);
     const selectedTicketType = selectedEvent.ticketTypes.find(t => t.name === ticketTypeName);
     
-    const ticketPromises = [];
+    const tickets = [];
     for (let i = 0; i < quantity; i++) {
-        const ticketData = {
+        tickets.push({
             eventId: selectedEventId, eventName: selectedEvent.eventName,
             buyerName: quantity > 1 ? `${buyerName} (${i + 1}/${quantity})` : buyerName,
             ticketType: ticketTypeName, pricePaid: selectedTicketType.price,
             paymentMethod: paymentMethod
-        };
-        const promise = fetch('/api/event/ticket/create', {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${token}` },
-            body: JSON.stringify(ticketData),
-        }).then(response => response.json());
-        ticketPromises.push(promise);
+        });
     }
 
     try {
-        const results = await Promise.all(ticketPromises);
+        // Todos os convites da venda são emitidos num único pedido
+        const response = await fetch('/api/event/ticket/create-batch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Authorization': `Bearer ${token}` },
+            body: JSON.stringify({ tickets: tickets }),
+        });
+        const batchResult = await response.json();
+        const results = batchResult.results || [];
         responseArea.classList.remove('hidden');
         responseArea.style.backgroundColor = 'var(--cor-sucesso)';
         const successResults = results.filter(r => r.success);
@@ -0,0 +1,482 @@
+# ===================================================================
+# RENDERIZAÇÃO DE CONVITES EM PDF
+# Módulo independente do Firebase/Flask para poder correr nos processos
+# do pool de renderização sem carregar o resto da aplicação.
+# ===================================================================
+import hashlib
+import json
+import os
+import threading
+import time
+import queue
+import itertools
+import zipfile
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+import metrics
+import qr_render
+from exports import ZipStream
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_PATH = os.path.join(BASE_DIR, 'templates', 'ticket.html')
+STYLESHEET_PATH = os.path.join(BASE_DIR, 'templates', 'ticket.css')
+
+# --- Configuração ---
+PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR', os.path.join(BASE_DIR, '.pdf_cache'))
+PDF_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_MB', 256)) * 1024 * 1024
+PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', 2))
+# Com '1' este processo não tem pool próprio: as renderizações vão para a fila em disco e são
+# feitas pelo renderizador único da máquina (flask render-pdfs, arrancado pelo gunicorn.conf.py).
+PDF_RENDER_QUEUE = os.environ.get('PDF_RENDER_QUEUE', '0') == '1'
+PDF_QUEUE_POLL = float(os.environ.get('PDF_QUEUE_POLL', 0.1))
+# Renderizações em curso por exportação em lote (limita a memória ocupada por PDFs prontos).
+PDF_BUNDLE_WINDOW = int(os.environ.get('PDF_BUNDLE_WINDOW', 16))
+
+# Apenas estes campos aparecem no PDF; o resto (estado, check-in...) não invalida o cache.
+TICKET_RENDER_FIELDS = ['ticketId', 'buyerName', 'ticketType', 'controlNumber']
+EVENT_RENDER_FIELDS = ['eventName', 'eventLocation', 'eventDate', 'eventTime', 'supportContact', 'eventDetails']
+
+_jinja_env = Environment(loader=FileSystemLoader(os.path.join(BASE_DIR, 'templates')), autoescape=select_autoescape(['html']))
+
+_template_hash = hashlib.sha256()
+for path in (TEMPLATE_PATH, STYLESHEET_PATH):
+    with open(path, 'rb') as template_file:
+        _template_hash.update(template_file.read())
+TEMPLATE_VERSION = _template_hash.hexdigest()[:12]
+
+# A folha de estilos (e as fontes) são analisadas uma vez por processo e reutilizadas.
+# O WeasyPrint (Pango/cairo) só é importado aqui, no primeiro PDF renderizado pelo processo.
+_font_config = None
+_stylesheet = None
+
+def get_stylesheet():
+    global _font_config, _stylesheet
+    if _stylesheet is None:
+        from weasyprint import CSS
+        from weasyprint.text.fonts import FontConfiguration
+        _font_config = FontConfiguration()
+        _stylesheet = CSS(filename=STYLESHEET_PATH, font_config=_font_config)
+    return _stylesheet, _font_config
+
+def render_fields(ticket_data, event_data):
+    ticket = {field: ticket_data.get(field) for field in TICKET_RENDER_FIELDS}
+    event = {field: event_data.get(field) for field in EVENT_RENDER_FIELDS}
+    return ticket, event
+
+def pdf_cache_key(ticket, event):
+    # Endereçado pelo conteúdo: muda sempre que muda algo que aparece no convite
+    payload = repr((TEMPLATE_VERSION, sorted(ticket.items()), sorted(event.items())))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def render_ticket_pdf(ticket, event):
+    event = dict(event)
+    if event.get('eventDate'):
+        date_obj = datetime.strptime(event['eventDate'], '%Y-%m-%d')
+        event['eventDateFormatted'] = date_obj.strftime('%d/%m/%Y')
+    html_out = _jinja_env.get_template('ticket.html').render(ticket=ticket, event=event, qr_code_uri=qr_render.qr_data_uri(ticket['ticketId'], 4, 'svg'))
+    stylesheet, font_config = get_stylesheet()
+    from weasyprint import HTML
+    return HTML(string=html_out, base_url=BASE_DIR + os.sep).write_pdf(stylesheets=[stylesheet], font_config=font_config)
+
+# --- Cache em disco (partilhado entre os workers do Gunicorn) ---
+def _cache_path(key):
+    return os.path.join(PDF_CACHE_DIR, key[:2], key + '.pdf')
+
+def get_cached_pdf(key):
+    path = _cache_path(key)
+    try:
+        with open(path, 'rb') as f:
+            pdf = f.read()
+    except FileNotFoundError:
+        return None
+    os.utime(path)  # Marca como usado recentemente para o despejo LRU
+    return pdf
+
+def store_cached_pdf(key, pdf):
+    path = _cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(pdf)
+    os.replace(tmp_path, path)  # Escrita atómica: nunca se serve um PDF a meio
+    _note_stored(len(pdf))
+
+# Percorrer o diretório custa dezenas de ms com milhares de ficheiros, por isso cada processo
+# mantém uma estimativa do tamanho do cache e só o percorre quando a estimativa passa do limite
+# ou a cada PDF_CACHE_SCAN_EVERY gravações (apanha o que os outros processos gravaram).
+# O despejo desce até PDF_CACHE_LOW_WATER do limite, para não voltar a varrer logo a seguir.
+PDF_CACHE_SCAN_EVERY = int(os.environ.get('PDF_CACHE_SCAN_EVERY', 200))
+PDF_CACHE_LOW_WATER = 0.9
+
+_cache_size_lock = threading.Lock()
+_cache_size_estimate = None
+_stores_since_scan = 0
+
+def _note_stored(size):
+    global _cache_size_estimate, _stores_since_scan
+    with _cache_size_lock:
+        _stores_since_scan += 1
+        if _cache_size_estimate is not None:
+            _cache_size_estimate += size
+        if (_cache_size_estimate is not None and _cache_size_estimate <= PDF_CACHE_MAX_BYTES
+                and _stores_since_scan < PDF_CACHE_SCAN_EVERY):
+            return
+        _stores_since_scan = 0
+        _cache_size_estimate = _evict_if_needed()
+
+def _evict_if_needed():
+    # Devolve o tamanho total do cache depois do despejo
+    entries = []
+    total = 0
+    for root, _, files in os.walk(PDF_CACHE_DIR):
+        for name in files:
+            if not name.endswith('.pdf'):
+                continue
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+            total += stat.st_size
+    if total <= PDF_CACHE_MAX_BYTES:
+        return total
+    target = PDF_CACHE_MAX_BYTES * PDF_CACHE_LOW_WATER
+    for _, size, path in sorted(entries):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        if total <= target:
+            break
+    return total
+
+# --- Pool de renderização com prioridades ---
+# O trabalho de CPU corre em processos separados; os workers web só esperam (ou nem isso,
+# com a API de jobs). Os pedidos interativos passam à frente da pré-renderização e dos lotes.
+# Com PDF_RENDER_QUEUE só o renderizador da máquina tem pool (ver fila em disco, abaixo).
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PRERENDER = 5
+PRIORITY_BULK = 10
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_PRERENDER: 'prerender', PRIORITY_BULK: 'bulk'}
+# Tentativas extra de uma tarefa apanhada pela morte de um processo de renderização
+PDF_RENDER_RETRIES = 1
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+_render_queue = queue.PriorityQueue()
+_render_sequence = itertools.count()
+_render_slots = threading.Semaphore(PDF_RENDER_WORKERS)
+_dispatcher = None
+
+def _init_render_process():
+    # Cada processo de renderização carrega o WeasyPrint e as fontes ao arrancar, não no primeiro convite
+    get_stylesheet()
+
+def _noop():
+    return None
+
+def warm_up_render_pool():
+    # Com a fila em disco o pool (e o seu aquecimento) pertence ao renderizador da máquina
+    if not PDF_RENDER_QUEUE:
+        _start_render_processes()
+
+def _start_render_processes():
+    # Arranca já todos os processos do pool (o ProcessPoolExecutor cria-os a pedido)
+    pool = get_render_pool()
+    for future in [pool.submit(_noop) for _ in range(PDF_RENDER_WORKERS)]:
+        future.result()
+
+def _new_render_pool():
+    # Processos 'spawn': não herdam os canais gRPC do Firestore do processo web
+    return ProcessPoolExecutor(max_workers=PDF_RENDER_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_render_process)
+
+def get_render_pool():
+    global _render_pool, _dispatcher
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = _new_render_pool()
+            _dispatcher = threading.Thread(target=_dispatch_loop, daemon=True)
+            _dispatcher.start()
+        return _render_pool
+
+def _replace_broken_pool(broken):
+    # Um processo de renderização que morre (falta de memória, crash do Pango) deixa o pool
+    # inteiro em BrokenProcessPool: cria um novo em vez de falhar todas as renderizações seguintes
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is broken:
+            _render_pool = _new_render_pool()
+            broken.shutdown(wait=False)
+        return _render_pool
+
+def _dispatch_loop():
+    # Só entrega ao pool tantas tarefas quantos os processos livres, para que a fila
+    # de prioridades (e não a fila FIFO interna do pool) decida a ordem
+    while True:
+        task = _render_queue.get()
+        priority, _, fn, args, result, enqueued, _ = task
+        _render_slots.acquire()
+        queue_seconds = time.perf_counter() - enqueued
+        pool = _render_pool
+        try:
+            try:
+                pool_future = pool.submit(fn, *args)
+            except BrokenProcessPool:
+                pool = _replace_broken_pool(pool)
+                pool_future = pool.submit(fn, *args)
+        except Exception as e:
+            _render_slots.release()
+            result.set_exception(e)
+            continue
+        pool_future.add_done_callback(lambda done, pool=pool, task=task, queue_seconds=queue_seconds:
+                                      _finish_render(done, pool, task, queue_seconds))
+
+def _finish_render(pool_future, pool, task, queue_seconds):
+    _render_slots.release()
+    priority, sequence, fn, args, result, enqueued, attempt = task
+    error = pool_future.exception()
+    if isinstance(error, BrokenProcessPool):
+        _replace_broken_pool(pool)
+        if attempt < PDF_RENDER_RETRIES:
+            # Volta à fila com a mesma posição; um convite que mata sempre o processo falha à segunda
+            _render_queue.put((priority, sequence, fn, args, result, enqueued, attempt + 1))
+            return
+    if error is not None:
+        result.set_exception(error)
+    else:
+        pdf, render_seconds = pool_future.result()
+        metrics.record_pdf_render(PRIORITY_NAMES.get(priority, str(priority)), render_seconds, queue_seconds)
+        result.set_result(pdf)
+
+def submit_render(ticket, event, priority=PRIORITY_INTERACTIVE):
+    if PDF_RENDER_QUEUE:
+        return _submit_to_render_queue(ticket, event, priority)
+    get_render_pool()
+    result = Future()
+    _render_queue.put((priority, next(_render_sequence), _render_cached, (ticket, event), result, time.perf_counter(), 0))
+    return result
+
+def _render_cached(ticket, event):
+    # Corre no processo de renderização; devolve também o tempo do WeasyPrint (None se veio do cache)
+    key = pdf_cache_key(ticket, event)
+    pdf = get_cached_pdf(key)
+    if pdf is not None:
+        return pdf, None
+    started = time.perf_counter()
+    pdf = render_ticket_pdf(ticket, event)
+    render_seconds = time.perf_counter() - started
+    store_cached_pdf(key, pdf)
+    return pdf, render_seconds
+
+def get_or_render_pdf(ticket_data, event_data):
+    # Caminho rápido: PDF já em cache é uma simples leitura de ficheiro
+    ticket, event = render_fields(ticket_data, event_data)
+    pdf = get_cached_pdf(pdf_cache_key(ticket, event))
+    if pdf is None:
+        started = time.perf_counter()
+        pdf = submit_render(ticket, event, PRIORITY_INTERACTIVE).result()
+        metrics.record_call('pdf', 'render_wait', time.perf_counter() - started)
+    return pdf
+
+def submit_prerender(ticket_data, event_data):
+    ticket, event = render_fields(ticket_data, event_data)
+    return submit_render(ticket, event, PRIORITY_PRERENDER)
+
+# --- Jobs de renderização ---
+# O ID do job é a própria chave do cache, por isso qualquer worker do Gunicorn consegue
+# responder ao estado: 'done' se o PDF existe, 'pending' se há marcador, 'error' se falhou.
+PDF_JOB_TIMEOUT = int(os.environ.get('PDF_JOB_TIMEOUT', 600))
+
+def _job_marker(key, suffix):
+    return os.path.join(PDF_CACHE_DIR, 'jobs', f"{key}.{suffix}")
+
+def submit_render_job(ticket_data, event_data, priority=PRIORITY_INTERACTIVE):
+    ticket, event = render_fields(ticket_data, event_data)
+    key = pdf_cache_key(ticket, event)
+    if get_cached_pdf(key) is not None or job_status(key) == 'pending':
+        return key
+    os.makedirs(os.path.join(PDF_CACHE_DIR, 'jobs'), exist_ok=True)
+    with open(_job_marker(key, 'pending'), 'w'):
+        pass
+    try:
+        os.remove(_job_marker(key, 'error'))
+    except FileNotFoundError:
+        pass
+    submit_render(ticket, event, priority).add_done_callback(lambda done: _finish_job(key, done))
+    return key
+
+def _finish_job(key, future):
+    if future.exception() is not None:
+        with open(_job_marker(key, 'error'), 'w') as f:
+            f.write(str(future.exception()))
+    try:
+        os.remove(_job_marker(key, 'pending'))
+    except FileNotFoundError:
+        pass
+
+def job_status(key):
+    if os.path.exists(_cache_path(key)):
+        return 'done'
+    if os.path.exists(_job_marker(key, 'error')):
+        return 'error'
+    try:
+        # Um marcador antigo significa que o worker que tinha o job terminou entretanto
+        if time.time() - os.path.getmtime(_job_marker(key, 'pending')) < PDF_JOB_TIMEOUT:
+            return 'pending'
+    except FileNotFoundError:
+        pass
+    return 'unknown'
+
+# --- Fila em disco e renderizador único por máquina ---
+# Com um pool por worker do Gunicorn, 4 workers x PDF_RENDER_WORKERS processos disputavam
+# o CPU e a prioridade só valia dentro de cada worker. Com PDF_RENDER_QUEUE os workers
+# escrevem o pedido em PDF_CACHE_DIR/queue (nome = prioridade, hora, chave, para a ordem
+# alfabética ser a ordem de atendimento) e esperam que o PDF apareça no cache; um único
+# processo (run_render_server) consome a fila com o pool e a fila de prioridades acima.
+_queue_waiters = {}
+_queue_waiters_lock = threading.Lock()
+_queue_watcher = None
+
+def _render_queue_dir():
+    return os.path.join(PDF_CACHE_DIR, 'queue')
+
+def _submit_to_render_queue(ticket, event, priority):
+    global _queue_watcher
+    key = pdf_cache_key(ticket, event)
+    result = Future()
+    with _queue_waiters_lock:
+        already_queued = key in _queue_waiters
+        _queue_waiters.setdefault(key, []).append((result, time.monotonic() + PDF_JOB_TIMEOUT))
+        if _queue_watcher is None:
+            _queue_watcher = threading.Thread(target=_watch_render_queue, daemon=True)
+            _queue_watcher.start()
+    if not already_queued:
+        try:
+            os.remove(_job_marker(key, 'error'))
+        except FileNotFoundError:
+            pass
+        os.makedirs(_render_queue_dir(), exist_ok=True)
+        path = os.path.join(_render_queue_dir(), f"{priority:02d}-{time.time_ns():020d}-{key}.json")
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'ticket': ticket, 'event': event, 'priority': priority}, f, default=str)
+        os.replace(tmp_path, path)
+    return result
+
+def _watch_render_queue():
+    # Resolve os futures à espera quando o renderizador grava o PDF (ou o marcador de erro)
+    while True:
+        time.sleep(PDF_QUEUE_POLL)
+        with _queue_waiters_lock:
+            keys = list(_queue_waiters)
+        for key in keys:
+            pdf = get_cached_pdf(key)
+            error = None
+            if pdf is None:
+                try:
+                    with open(_job_marker(key, 'error')) as f:
+                        error = RuntimeError(f.read() or "Erro ao gerar PDF.")
+                except FileNotFoundError:
+                    pass
+            now = time.monotonic()
+            with _queue_waiters_lock:
+                waiters = _queue_waiters.pop(key, [])
+                if pdf is None and error is None:
+                    expired = [waiter for waiter in waiters if waiter[1] <= now]
+                    pending = [waiter for waiter in waiters if waiter[1] > now]
+                    if pending:
+                        _queue_waiters[key] = pending
+                    waiters = expired
+                    error = TimeoutError("O renderizador de PDFs não respondeu.")
+            for result, _ in waiters:
+                if pdf is not None:
+                    result.set_result(pdf)
+                else:
+                    result.set_exception(error)
+
+def _claim_queued_renders():
+    # O rename é atómico: se houver mais de um renderizador, cada pedido só é apanhado por um
+    try:
+        names = sorted(name for name in os.listdir(_render_queue_dir()) if name.endswith('.json'))
+    except FileNotFoundError:
+        return []
+    claimed = []
+    for name in names:
+        path = os.path.join(_render_queue_dir(), name)
+        try:
+            os.rename(path, path + '.claimed')
+        except FileNotFoundError:
+            continue
+        claimed.append(path + '.claimed')
+    return claimed
+
+def _finish_queued_render(path, key, future):
+    if future.exception() is not None:
+        os.makedirs(os.path.dirname(_job_marker(key, 'error')), exist_ok=True)
+        with open(_job_marker(key, 'error'), 'w') as f:
+            f.write(str(future.exception()))
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def run_render_server():
+    # Processo único por máquina: consome PDF_CACHE_DIR/queue com o pool de renderização local
+    os.makedirs(_render_queue_dir(), exist_ok=True)
+    # Pedidos apanhados por um renderizador que terminou a meio voltam para a fila
+    for name in os.listdir(_render_queue_dir()):
+        if name.endswith('.json.claimed'):
+            os.replace(os.path.join(_render_queue_dir(), name), os.path.join(_render_queue_dir(), name[:-len('.claimed')]))
+    _start_render_processes()
+    while True:
+        claimed = _claim_queued_renders()
+        for path in claimed:
+            key = os.path.basename(path).split('.')[0].rsplit('-', 1)[-1]
+            try:
+                with open(path) as f:
+                    job = json.load(f)
+            except (OSError, ValueError) as e:
+                future = Future()
+                future.set_exception(e)
+                _finish_queued_render(path, key, future)
+                continue
+            future = Future()
+            future.add_done_callback(lambda done, path=path, key=key: _finish_queued_render(path, key, done))
+            get_render_pool()
+            _render_queue.put((job['priority'], next(_render_sequence), _render_cached, (job['ticket'], job['event']),
+                               future, time.perf_counter(), 0))
+        if not claimed:
+            time.sleep(PDF_QUEUE_POLL)
+
+# --- Exportação em lote (ZIP em streaming) ---
+def iter_rendered_pdfs(tickets_data, event_data):
+    # Renderiza em paralelo no pool, mas devolve pela ordem original e com no máximo
+    # PDF_BUNDLE_WINDOW PDFs em memória de cada vez
+    _, event = render_fields({}, event_data)
+    in_flight = deque()
+    for ticket_data in tickets_data:
+        ticket, _ = render_fields(ticket_data, {})
+        in_flight.append((ticket, submit_render(ticket, event, PRIORITY_BULK)))
+        if len(in_flight) >= PDF_BUNDLE_WINDOW:
+            ticket, future = in_flight.popleft()
+            yield ticket, future.result()
+    while in_flight:
+        ticket, future = in_flight.popleft()
+        yield ticket, future.result()
+
+def stream_pdf_zip(tickets_data, event_data):
+    stream = ZipStream()
+    # ZIP_STORED: os PDFs já vêm comprimidos
+    with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for ticket, pdf in iter_rendered_pdfs(tickets_data, event_data):
+            archive.writestr(f"convite_{ticket['ticketId']}.pdf", pdf)
+            yield stream.drain()
+    yield stream.drain()